@@ -0,0 +1,220 @@
+"""
+Admission control and rate limiting in front of the connection pool.
+
+Each request that reaches the database takes a slot before its view runs and
+gives it back once the response is sent, so a streamed response keeps its
+slot to the end. A worker hands out at most as many slots as its pool has
+connections. A request that finds no free slot waits up to
+ADMISSION_WAIT_MS, in a queue of at most ADMISSION_QUEUE_SIZE requests.
+When the queue is full or the wait runs out, the request gets 503 with
+Retry-After straight away. Without this, requests queue inside the pool
+for its 30 s timeout and then fail.
+
+Requests are admitted by class, in priority order:
+
+    read    GET and HEAD
+    write   other methods
+    bulk    the batch endpoints, at most ADMISSION_BULK_LIMIT at once
+
+A class is not admitted while a higher class is waiting, so reads go ahead
+of writes and writes go ahead of bulk writes. ADMISSION_ROUTE_LIMITS caps
+single routes, as `endpoint=limit` pairs separated by commas.
+
+RATE_LIMIT_PER_SECOND turns on a token bucket per client, holding up to
+RATE_LIMIT_BURST tokens. A client out of tokens gets 429 with Retry-After.
+A client is identified by the RATE_LIMIT_CLIENT_HEADER header when set,
+otherwise by its address. Behind a proxy, main takes that address from
+X-Forwarded-For (TRUSTED_PROXY_COUNT), so clients do not share the bucket
+of the proxy.
+
+The limits apply per worker process.
+"""
+import collections
+import math
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+
+import metrics
+
+CLASSES = ('read', 'write', 'bulk')
+
+shed_total = metrics.registry.add(metrics.Counter(
+    'http_requests_shed_total', 'Requests turned away before reaching the database, by route and reason.',
+    ('route', 'reason')))
+
+
+def parse_limits(value: str) -> dict:
+    limits = {}
+    for pair in filter(None, (part.strip() for part in value.split(','))):
+        name, _, limit = pair.partition('=')
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+class Gate:
+    """Concurrency limits by request class and route, with a bounded wait queue."""
+
+    def __init__(self, capacity: int, bulk_limit: int = None, route_limits: dict = None,
+                 max_waiting: int = 20, wait_seconds: float = 1.0):
+        self.route_limits = route_limits or {}
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.active = collections.Counter()
+        self.active_routes = collections.Counter()
+        self.waiting = collections.Counter()
+        self.condition = threading.Condition()
+        self.configure(capacity, bulk_limit)
+
+    def configure(self, capacity: int, bulk_limit: int = None) -> None:
+        with self.condition:
+            self.capacity = capacity
+            self.limits = {
+                'read': capacity,
+                'write': capacity,
+                'bulk': bulk_limit or max(1, capacity // 4),
+            }
+            self.condition.notify_all()
+
+    def can_enter(self, route: str, kind: str) -> bool:
+        if sum(self.active.values()) >= self.capacity or self.active[kind] >= self.limits[kind]:
+            return False
+        if self.active_routes[route] >= self.route_limits.get(route, self.capacity):
+            return False
+        return not any(self.waiting[higher] for higher in CLASSES[:CLASSES.index(kind)])
+
+    def acquire(self, route: str, kind: str) -> str:
+        """Takes a slot and returns None, or returns why none was free."""
+        deadline = time.monotonic() + self.wait_seconds
+        with self.condition:
+            if not self.can_enter(route, kind):
+                if sum(self.waiting.values()) >= self.max_waiting:
+                    return 'queue_full'
+                self.waiting[kind] += 1
+                try:
+                    while not self.can_enter(route, kind):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return 'wait_timeout'
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting[kind] -= 1
+                    # A lower class may have been held back by this waiter
+                    self.condition.notify_all()
+            self.active[kind] += 1
+            self.active_routes[route] += 1
+            return None
+
+    def release(self, route: str, kind: str) -> None:
+        with self.condition:
+            self.active[kind] -= 1
+            self.active_routes[route] -= 1
+            self.condition.notify_all()
+
+
+class TokenBuckets:
+    """A token bucket per client, for the most recent `max_clients` clients."""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        # client -> (tokens, time of the last refill), least recently seen first
+        self.buckets = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, client: str) -> float:
+        """Takes a token and returns 0, or the seconds until one is available."""
+        now = self.clock()
+        with self.lock:
+            tokens, updated = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[client] = (tokens, now)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+def retry_after(response, seconds: float):
+    response.headers['Retry-After'] = str(max(1, math.ceil(seconds)))
+    return response
+
+
+class Admission:
+    """
+    Flask hooks that rate limit and admit requests. Endpoints in `exempt`
+    pass straight through, and those in `bulk` are admitted as bulk writes.
+    """
+
+    def __init__(self, gate: Gate, buckets: TokenBuckets = None, exempt=(), bulk=(), client_header: str = None):
+        self.gate = gate
+        self.buckets = buckets
+        self.exempt = set(exempt)
+        self.bulk = set(bulk)
+        self.client_header = client_header
+
+    def classify(self) -> str:
+        if request.endpoint in self.bulk:
+            return 'bulk'
+        return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+    def client(self) -> str:
+        if self.client_header and request.headers.get(self.client_header):
+            return request.headers[self.client_header]
+        return request.remote_addr or ''
+
+    def before_request(self):
+        route = request.endpoint
+        if route is None or route in self.exempt:
+            return None
+        label = request.url_rule.rule
+        if self.buckets is not None:
+            wait = self.buckets.take(self.client())
+            if wait:
+                shed_total.inc(label, 'rate_limited')
+                return retry_after(jsonify({"Error": "Too many requests. Try again shortly"}), wait), 429
+        kind = self.classify()
+        reason = self.gate.acquire(route, kind)
+        if reason is not None:
+            shed_total.inc(label, reason)
+            return retry_after(jsonify({"Error": "The server is busy. Try again shortly"}), 1), 503
+        g.admission = (route, kind)
+        return None
+
+    def teardown_request(self, error=None) -> None:
+        admitted = g.pop('admission', None)
+        if admitted is not None:
+            self.gate.release(*admitted)
+
+
+def from_environ(capacity: int, exempt=(), bulk=()) -> Admission:
+    """Builds the admission hooks from the ADMISSION_* and RATE_LIMIT_* settings."""
+    gate = Gate(
+        capacity,
+        bulk_limit=int(os.environ.get('ADMISSION_BULK_LIMIT', 0)) or None,
+        route_limits=parse_limits(os.environ.get('ADMISSION_ROUTE_LIMITS', '')),
+        max_waiting=int(os.environ.get('ADMISSION_QUEUE_SIZE', 20)),
+        wait_seconds=float(os.environ.get('ADMISSION_WAIT_MS', 1000)) / 1000,
+    )
+    buckets = None
+    rate = float(os.environ.get('RATE_LIMIT_PER_SECOND', 0))
+    if rate > 0:
+        buckets = TokenBuckets(rate, float(os.environ.get('RATE_LIMIT_BURST', 0)) or max(1.0, 2 * rate))
+    return Admission(gate, buckets, exempt, bulk, os.environ.get('RATE_LIMIT_CLIENT_HEADER'))
+
+
+def instrument_app(app, admission: Admission) -> None:
+    app.before_request(admission.before_request)
+    app.teardown_request(admission.teardown_request)
+    metrics.registry.add(metrics.Gauge('admission_waiting', 'Requests waiting for an admission slot.',
+                                       lambda: sum(admission.gate.waiting.values())))
+    metrics.registry.add(metrics.Gauge('admission_active', 'Requests holding an admission slot.',
+                                       lambda: sum(admission.gate.active.values())))
@@ -0,0 +1,570 @@
+"""
+Async (ASGI) entry point for the business and review routes of main.py.
+
+The handlers mirror the Flask views but await an async SQLAlchemy engine,
+so one process keeps many requests in flight on a small connection pool
+instead of holding a worker thread per blocking query. Both apps build
+bodies from the same row models and serializer, so they return identical
+bytes.
+
+    ASYNC_DATABASE_URL=sqlite+aiosqlite:///local.db uvicorn asgi:app
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+ASYNC_DATABASE_URL defaults to DATABASE_URL with its driver swapped for
+aiosqlite or aiomysql. The Cloud SQL Python Connector has no aiomysql
+support, so against Cloud SQL point the URL at the instance's private IP or
+at the Cloud SQL Auth Proxy. The optional packages are listed in
+requirements-async.txt. The batch endpoints, streamed list responses,
+conditional requests (ETag, If-None-Match, If-Match) and compressed
+responses are served only by the Flask app; edits made here still advance
+the row versions behind them.
+"""
+import os
+import re
+import urllib.parse
+
+from flask import json
+import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import main
+from cache import business_key, review_key
+from models import Business, FieldSet, Review
+from serializer import encode
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+}
+
+
+def async_database_url() -> str:
+    url = os.environ.get('ASYNC_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    if not url:
+        raise ValueError(
+            'Missing database connection type. Please define ASYNC_DATABASE_URL or DATABASE_URL'
+        )
+    scheme, separator, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+def init_async_engine() -> sqlalchemy.ext.asyncio.AsyncEngine:
+    url = async_database_url()
+    if url.startswith('sqlite'):
+        engine = create_async_engine(url, connect_args={'timeout': 30})
+
+        @sqlalchemy.event.listens_for(engine.sync_engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA foreign_keys=ON')
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.close()
+
+        return engine
+
+    # Requests wait on the pool without holding a thread, so the same small
+    # pool as the sync app serves far more concurrent requests.
+    return create_async_engine(
+        url,
+        pool_size=int(os.environ.get('ASYNC_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('ASYNC_MAX_OVERFLOW', 2)),
+        pool_timeout=30,
+        pool_recycle=1800,
+    )
+
+
+engine = None
+
+
+class Request:
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {}
+        for key, value in urllib.parse.parse_qsl(scope.get('query_string', b'').decode('latin-1'),
+                                                 keep_blank_values=True):
+            self.args.setdefault(key, value)
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                        for key, value in scope.get('headers', [])}
+        server = scope.get('server') or ('localhost', None)
+        default_host = server[0] if server[1] in (None, 80, 443) else f'{server[0]}:{server[1]}'
+        self.host = self.headers.get('host', default_host)
+        self.url_root = f"{scope.get('scheme', 'http')}://{self.host}{scope.get('root_path', '')}/"
+        self.body = body
+
+    def get_json(self):
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+# Encodes a body with the serializer the Flask app uses
+def respond(body, status: int = 200):
+    if body == '':
+        return status, b'', 'text/html; charset=utf-8'
+    return status, encode(body) + b'\n', 'application/json'
+
+
+def missing_fields(content, fields) -> bool:
+    return not isinstance(content, dict) or not all(field in content for field in fields)
+
+
+def include_stats(req: Request) -> bool:
+    return 'stats' in req.args.get('include', '').split(',')
+
+
+async def index(req):
+    return 200, b'Please navigate to /businesses to use this API', 'text/html; charset=utf-8'
+
+
+# Create a new business
+async def create_business(req):
+    content = req.get_json()
+    if missing_fields(content, main.BUSINESS_FIELDS):
+        return respond({"Error": main.ERROR_MISSING_ATTRIBUTES}, 400)
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                sqlalchemy.text(
+                    'INSERT INTO businesses(owner_id, name, street_address, city, state, zip_code) '
+                    'VALUES (:owner_id, :name, :street_address, :city, :state, :zip_code)'
+                ),
+                {field: content[field] for field in main.BUSINESS_FIELDS}
+            )
+            business_id = result.lastrowid
+            await conn.execute(main.INSERT_BUSINESS_STATS_STMT, {'business_id': business_id})
+            await conn.commit()
+    except Exception as e:
+        main.logger.exception(e)
+        return respond({'Error': 'Unable to create business'}, 500)
+
+    business = Business(business_id, *(content[field] for field in main.BUSINESS_FIELDS))
+    return respond(business.to_dict(req.url_root), 201)
+
+
+# Return a page of businesses, by offset or by keyset cursor
+async def get_businesses(req):
+    if 'ids' in req.args:
+        return await get_businesses_by_id(req)
+    try:
+        page, params, sort, filters, limit, offset = main.business_list_page(req.args)
+        fieldset = FieldSet.parse(Business, req.args.get('fields'))
+    except ValueError as e:
+        return respond({"Error": str(e)}, 400)
+
+    with_stats = include_stats(req)
+    columns = fieldset.columns('b')
+    source = main.business_list_source(with_stats, sort, filters)
+    if with_stats:
+        columns += f', {main.STATS_COLUMNS}'
+    if sort == 'rating':
+        columns += ', s.rating'
+
+    async with engine.connect() as conn:
+        result = await conn.execute(sqlalchemy.text(f'SELECT {columns} FROM {source} {page}'), params)
+        results = result.all()
+
+    businesses = [fieldset.row_dict(row, req.url_root) for row in results]
+    if with_stats:
+        # The stats columns follow the business columns
+        stats_start = len(fieldset.column_names)
+        for business_dict, row in zip(businesses, results):
+            business_dict['stats'] = main.stats_dict(row[stats_start:stats_start + len(main.STATS_FIELDS)])
+
+    next_url = main.business_list_next(req.url_root, req.args, sort, filters, limit, offset, results)
+    return respond({'entries': businesses, 'next': next_url})
+
+
+# GET /businesses?ids=1,2,3: the named businesses in the order named, and the
+# ids that do not exist under `missing`
+async def get_businesses_by_id(req):
+    try:
+        ids = main.parse_ids(req.args['ids'])
+        fieldset = FieldSet.parse(Business, req.args.get('fields'))
+    except ValueError as e:
+        return respond({"Error": str(e)}, 400)
+    found = await load_businesses(ids)
+    ordered = [found[business_id] for business_id in ids if business_id in found]
+    businesses = [fieldset.to_dict(business, req.url_root) for business in ordered]
+    if include_stats(req) and found:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(main.LOAD_STATS_STMT, {'ids': list(found)})).all()
+        stats = {row[0]: row[1:] for row in rows}
+        for business, business_dict in zip(ordered, businesses):
+            business_dict['stats'] = main.stats_dict(stats.get(business.id, [None] * len(main.STATS_FIELDS)))
+    return respond({
+        'entries': businesses,
+        'missing': [business_id for business_id in ids if business_id not in found]
+    })
+
+
+# Loads businesses by id, from the row cache where possible and with one IN
+# query for the rest, as main.load_businesses does
+async def load_businesses(ids) -> dict:
+    found = {}
+    missing = []
+    for business_id in ids:
+        entry = main.cache.get(business_key(business_id))
+        if entry is None:
+            missing.append(business_id)
+        else:
+            found[business_id] = Business(**entry)
+    if missing:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(main.LOAD_BUSINESSES_STMT, {'ids': missing})).all()
+        for row in rows:
+            business = Business.from_row(row)
+            main.cache.set(business_key(business.id), business.fields())
+            found[business.id] = business
+    return found
+
+
+# Return a single business
+async def get_business(req, id):
+    try:
+        expand = main.requested_expansions(req.args, ('reviews',))
+        reviews_limit = int(req.args.get('reviews_limit', main.EXPAND_REVIEWS_LIMIT))
+    except ValueError as e:
+        return respond({"Error": str(e)}, 400)
+    if not 1 <= reviews_limit <= main.EXPAND_REVIEWS_MAX_LIMIT:
+        return respond({"Error": f"reviews_limit must be from 1 to {main.EXPAND_REVIEWS_MAX_LIMIT}"}, 400)
+    business = main.cache.get(business_key(id))
+    if business is None:
+        async with engine.connect() as conn:
+            result = (await conn.execute(
+                sqlalchemy.text(f'SELECT {Business.columns()} FROM businesses WHERE business_id = :business_id'),
+                {'business_id': id}
+            )).one_or_none()
+        if result is None:
+            return respond(main.ERORR_NOT_FOUND, 404)
+        business = Business.from_row(result)
+        main.cache.set(business_key(id), business.fields())
+    else:
+        business = Business(**business)
+
+    body = business.to_dict(req.url_root)
+    if include_stats(req):
+        async with engine.connect() as conn:
+            stats = (await conn.execute(
+                sqlalchemy.text(f'SELECT {main.STATS_COLUMNS} FROM business_stats s WHERE s.business_id = :business_id'),
+                {'business_id': id}
+            )).one_or_none()
+        body['stats'] = main.stats_dict(stats or [None] * len(main.STATS_FIELDS))
+    if 'reviews' in expand:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(main.GET_BUSINESS_REVIEWS_STMT,
+                                       {'business_id': id, 'limit': reviews_limit})).all()
+        body['reviews'] = [Review.from_row(row).to_dict(req.url_root) for row in rows]
+    return respond(body)
+
+
+# Edit a business
+async def edit_business(req, id):
+    content = req.get_json()
+    if missing_fields(content, main.BUSINESS_FIELDS):
+        return respond({"Error": main.ERROR_MISSING_ATTRIBUTES}, 400)
+
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            sqlalchemy.text(
+                'UPDATE businesses '
+                'SET owner_id = :owner_id, name = :name, street_address = :street_address, city = :city, state = :state, zip_code = :zip_code, '
+                'version = version + 1 '
+                'WHERE business_id = :business_id'
+            ),
+            dict({field: content[field] for field in main.BUSINESS_FIELDS}, business_id=id)
+        )
+        if result.rowcount == 0:
+            await conn.rollback()
+            return respond(main.ERORR_NOT_FOUND, 404)
+        await conn.commit()
+    main.cache.invalidate(business_key(id))
+
+    business = Business(id, *(content[field] for field in main.BUSINESS_FIELDS))
+    return respond(business.to_dict(req.url_root))
+
+
+# Delete a business and, through the FK cascade, its reviews and stats
+async def delete_business(req, id):
+    async with engine.connect() as conn:
+        review_ids = (await conn.execute(
+            sqlalchemy.text('SELECT review_id FROM reviews WHERE business_id=:business_id'),
+            {'business_id': id}
+        )).scalars().all()
+        result = await conn.execute(
+            sqlalchemy.text('DELETE FROM businesses WHERE business_id=:business_id'),
+            {'business_id': id}
+        )
+        await conn.commit()
+    if result.rowcount == 1:
+        main.cache.invalidate(business_key(id), *(review_key(review_id) for review_id in review_ids))
+        return respond('', 204)
+    return respond(main.ERORR_NOT_FOUND, 404)
+
+
+# List all businesses for an owner
+async def get_owners_businesses(req, owner_id):
+    try:
+        fieldset = FieldSet.parse(Business, req.args.get('fields'))
+    except ValueError as e:
+        return respond({"Error": str(e)}, 400)
+    async with engine.connect() as conn:
+        results = (await conn.execute(
+            sqlalchemy.text(f'SELECT {fieldset.columns()} FROM businesses WHERE owner_id = :owner_id'),
+            {'owner_id': owner_id}
+        )).all()
+    if not results:
+        return respond({"Error": "No businesses found for this owner_id"}, 404)
+    return respond([fieldset.row_dict(row, req.url_root) for row in results])
+
+
+# Return the rating stats of a business
+async def get_business_stats(req, id):
+    async with engine.connect() as conn:
+        result = (await conn.execute(
+            sqlalchemy.text(
+                f'SELECT b.business_id, {main.STATS_COLUMNS} '
+                'FROM businesses b LEFT JOIN business_stats s ON s.business_id = b.business_id '
+                'WHERE b.business_id = :business_id'
+            ),
+            {'business_id': id}
+        )).one_or_none()
+    if result is None:
+        return respond(main.ERORR_NOT_FOUND, 404)
+    stats = main.stats_dict(result[1:])
+    stats['business'] = f"{req.url_root}businesses/{id}"
+    stats['self'] = f"{req.url_root}businesses/{id}/stats"
+    return respond(stats)
+
+
+# Create a new review
+async def create_review(req):
+    content = req.get_json()
+    if missing_fields(content, main.REVIEW_FIELDS):
+        return respond({"Error": main.ERROR_MISSING_ATTRIBUTES}, 400)
+    if not main.valid_stars(content['stars']):
+        return respond({"Error": main.ERROR_INVALID_STARS}, 400)
+    if not main.valid_review_text(content.get('review_text', '')):
+        return respond({"Error": main.ERROR_INVALID_REVIEW_TEXT}, 400)
+
+    review_text = content.get('review_text', '')
+    async with engine.connect() as conn:
+        try:
+            try:
+                result = await conn.execute(
+                    sqlalchemy.text(
+                        "INSERT INTO reviews (user_id, business_id, stars, review_text) VALUES (:user_id, :business_id, :stars, :review_text)"
+                    ),
+                    {'user_id': content['user_id'], 'business_id': content['business_id'],
+                     'stars': content['stars'], 'review_text': review_text}
+                )
+            except sqlalchemy.exc.IntegrityError as e:
+                await conn.rollback()
+                if main.is_duplicate_key(e):
+                    return respond({"Error": main.ERROR_DUPLICATE_REVIEW}, 409)
+                if main.is_missing_reference(e):
+                    return respond(main.ERORR_NOT_FOUND, 404)
+                raise
+            review_id = result.lastrowid
+            await conn.execute(main.stats_upsert_stmt(conn.dialect.name),
+                               [main.stats_delta(content['business_id'], added=[content['stars']])])
+            await conn.commit()
+        except Exception as e:
+            main.logger.exception("Failed to create review: %s", e)
+            await conn.rollback()
+            return respond({'Error': 'Unable to create review', 'Exception': str(e)}, 500)
+
+    review = Review(review_id, content['user_id'], content['business_id'], content['stars'], review_text)
+    return respond(review.to_dict(req.url_root), 201)
+
+
+# List a single review
+async def get_review(req, review_id):
+    try:
+        expand = main.requested_expansions(req.args, ('business',))
+    except ValueError as e:
+        return respond({"Error": str(e)}, 400)
+    review = main.cache.get(review_key(review_id))
+    if review is None:
+        async with engine.connect() as conn:
+            result = (await conn.execute(
+                sqlalchemy.text(f'SELECT {Review.columns()} FROM reviews WHERE review_id = :review_id'),
+                {'review_id': review_id}
+            )).one_or_none()
+        if result is None:
+            return respond(main.ERORR_NOT_FOUND_REVIEW, 404)
+        review = Review.from_row(result)
+        main.cache.set(review_key(review_id), review.fields())
+    else:
+        review = Review(**review)
+    body = review.to_dict(req.url_root, omit_empty_text=True)
+    if 'business' in expand:
+        business = (await load_businesses([review.business_id])).get(review.business_id)
+        if business is not None:
+            body['business'] = business.to_dict(req.url_root)
+    return respond(body)
+
+
+# Edit a review
+async def edit_review(req, review_id):
+    content = req.get_json()
+    if missing_fields(content, ['stars']):
+        return respond({"Error": main.ERROR_MISSING_ATTRIBUTES}, 400)
+    if not main.valid_stars(content['stars']):
+        return respond({"Error": main.ERROR_INVALID_STARS}, 400)
+    if 'review_text' in content and not main.valid_review_text(content['review_text']):
+        return respond({"Error": main.ERROR_INVALID_REVIEW_TEXT}, 400)
+
+    async with engine.connect() as conn:
+        existing_review = (await conn.execute(
+            sqlalchemy.text("SELECT user_id, business_id, stars, review_text FROM reviews WHERE review_id = :review_id"
+                            + main.for_update(conn)),
+            {'review_id': review_id}
+        )).mappings().one_or_none()
+        if not existing_review:
+            return respond(main.ERORR_NOT_FOUND_REVIEW, 404)
+
+        review_text = content.get('review_text', existing_review['review_text'])
+        await conn.execute(
+            sqlalchemy.text("UPDATE reviews SET stars = :stars, review_text = :review_text, version = version + 1 "
+                            "WHERE review_id = :review_id"),
+            {'review_id': review_id, 'stars': content['stars'], 'review_text': review_text}
+        )
+        if existing_review['stars'] != content['stars']:
+            await conn.execute(main.stats_upsert_stmt(conn.dialect.name),
+                               [main.stats_delta(existing_review['business_id'],
+                                                 added=[content['stars']],
+                                                 removed=[existing_review['stars']])])
+        await conn.commit()
+    main.cache.invalidate(review_key(review_id))
+
+    review = Review(review_id, existing_review['user_id'], existing_review['business_id'], content['stars'], review_text)
+    return respond(review.to_dict(req.url_root))
+
+
+# Delete a review
+async def delete_review(req, review_id):
+    async with engine.connect() as conn:
+        await conn.execute(sqlalchemy.text(main.STATS_REMOVE_REVIEW[conn.dialect.name]),
+                           {'review_id': review_id})
+        result = await conn.execute(
+            sqlalchemy.text("DELETE FROM reviews WHERE review_id = :review_id"),
+            {'review_id': review_id}
+        )
+        if result.rowcount == 0:
+            await conn.rollback()
+            return respond(main.ERORR_NOT_FOUND_REVIEW, 404)
+        await conn.commit()
+    main.cache.invalidate(review_key(review_id))
+    return respond('', 204)
+
+
+# List all reviews for a user_id
+async def get_users_reviews(req, user_id):
+    try:
+        fieldset = FieldSet.parse(Review, req.args.get('fields'))
+        expand = main.requested_expansions(req.args, ('business',))
+    except ValueError as e:
+        return respond({"Error": str(e)}, 400)
+    # businesses is only joined to embed each review's business
+    if 'business' in expand:
+        query = (f'SELECT {fieldset.columns("r")}, {Business.columns("b")} '
+                 'FROM reviews r JOIN businesses b ON b.business_id = r.business_id WHERE r.user_id = :user_id')
+        business_start = len(fieldset.column_names)
+
+        def build(row, url_root):
+            review_dict = fieldset.row_dict(row, url_root)
+            review_dict['business'] = Business.from_row(row[business_start:]).to_dict(url_root)
+            return review_dict
+    else:
+        query = f'SELECT {fieldset.columns()} FROM reviews WHERE user_id = :user_id'
+        build = fieldset.row_dict
+    async with engine.connect() as conn:
+        results = (await conn.execute(sqlalchemy.text(query), {'user_id': user_id})).all()
+    if not results:
+        return respond({"Error": "No reviews found for this user"}, 404)
+    return respond([build(row, req.url_root) for row in results])
+
+
+ROUTES = [
+    ('GET', r'/', index),
+    ('POST', r'/businesses', create_business),
+    ('GET', r'/businesses', get_businesses),
+    ('GET', r'/businesses/(?P<id>\d+)', get_business),
+    ('PUT', r'/businesses/(?P<id>\d+)', edit_business),
+    ('DELETE', r'/businesses/(?P<id>\d+)', delete_business),
+    ('GET', r'/businesses/(?P<id>\d+)/stats', get_business_stats),
+    ('GET', r'/owners/(?P<owner_id>\d+)/businesses', get_owners_businesses),
+    ('POST', r'/reviews', create_review),
+    ('GET', r'/reviews/(?P<review_id>\d+)', get_review),
+    ('PUT', r'/reviews/(?P<review_id>\d+)', edit_review),
+    ('DELETE', r'/reviews/(?P<review_id>\d+)', delete_review),
+    ('GET', r'/users/(?P<user_id>\d+)/reviews', get_users_reviews),
+]
+COMPILED_ROUTES = [(method, re.compile(pattern + r'\Z'), handler) for method, pattern, handler in ROUTES]
+
+
+def resolve(method: str, path: str):
+    allowed = False
+    for route_method, pattern, handler in COMPILED_ROUTES:
+        match = pattern.match(path)
+        if match:
+            if route_method == method:
+                return handler, {key: int(value) for key, value in match.groupdict().items()}
+            allowed = True
+    return (405 if allowed else 404), None
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def lifespan(receive, send):
+    global engine
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            engine = init_async_engine()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if engine is not None:
+                await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    global engine
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if engine is None:
+        engine = init_async_engine()
+
+    req = Request(scope, await read_body(receive))
+    handler, params = resolve(req.method, req.path)
+    if params is None:
+        status, body, content_type = respond({"Error": "Not Found" if handler == 404 else "Method Not Allowed"}, handler)
+    else:
+        try:
+            status, body, content_type = await handler(req, **params)
+        except Exception as e:
+            main.logger.exception(e)
+            status, body, content_type = respond({"Error": "Internal Server Error"}, 500)
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')),
+                    (b'content-length', str(len(body)).encode('latin-1'))],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,3 @@
+# Benchmark harness: `bench.seed` fills a local database, `bench.run` drives
+# a scenario against the app and stores a latency report, and `bench.compare`
+# diffs two reports.
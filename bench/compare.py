@@ -0,0 +1,49 @@
+"""
+Compares two bench.run reports route by route.
+
+    python -m bench.compare bench/results/base.json bench/results/new.json --max-regression 0.10
+
+Exits with status 1 if any route's p95 latency grew by more than
+--max-regression (a fraction) over the baseline.
+"""
+import argparse
+import json
+
+
+def change(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--max-regression', type=float, default=None)
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline_file, open(args.candidate) as candidate_file:
+        baseline = json.load(baseline_file)
+        candidate = json.load(candidate_file)
+
+    print(f"{'route':<28}{'p50':>18}{'p95':>18}{'p99':>18}{'rps':>18}")
+    regressions = []
+    routes = dict(baseline['routes'], TOTAL=baseline['total'])
+    candidate_routes = dict(candidate['routes'], TOTAL=candidate['total'])
+    for name, old in routes.items():
+        new = candidate_routes.get(name)
+        if new is None:
+            continue
+        cells = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            cells.append(f"{new[metric]:>9.2f} {change(old[metric], new[metric]):>+7.1%}")
+        print(f"{name:<28}" + ''.join(f'{cell:>18}' for cell in cells))
+        if args.max_regression is not None and change(old['p95_ms'], new['p95_ms']) > args.max_regression:
+            regressions.append(name)
+
+    if regressions:
+        print(f"p95 regressed more than {args.max_regression:.0%} on: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,93 @@
+"""
+Checks how many SQL statements each endpoint issues per request.
+
+    python -m bench.query_budget
+
+Every request in CHECKS runs once against a scratch SQLite database, with
+the row cache cleared first so reads reach the database. The script exits
+with status 1 if a request gets an unexpected status or issues more
+statements than its budget. Every statement is a round trip to Cloud SQL,
+so a budget should only go up together with the change that needs it.
+"""
+import contextlib
+import os
+import sys
+import tempfile
+
+import sqlalchemy
+
+BUSINESS = {'owner_id': 7, 'name': 'Budget Cafe', 'street_address': '1 Main St',
+            'city': 'Seattle', 'state': 'WA', 'zip_code': 98101}
+
+# (name, method, path, body, expected status, statement budget)
+CHECKS = [
+    ('create_business', 'POST', '/businesses', BUSINESS, 201, 2),
+    ('edit_business', 'PUT', '/businesses/1', dict(BUSINESS, name='Renamed'), 200, 1),
+    ('edit_business_missing', 'PUT', '/businesses/999', BUSINESS, 404, 1),
+    ('create_review', 'POST', '/reviews', {'user_id': 1, 'business_id': 1, 'stars': 4}, 201, 2),
+    ('create_review_duplicate', 'POST', '/reviews', {'user_id': 1, 'business_id': 1, 'stars': 4}, 409, 1),
+    ('create_review_missing_business', 'POST', '/reviews', {'user_id': 1, 'business_id': 999, 'stars': 4}, 404, 1),
+    ('edit_review', 'PUT', '/reviews/1', {'stars': 2}, 200, 3),
+    ('edit_review_missing', 'PUT', '/reviews/999', {'stars': 2}, 404, 1),
+    ('get_business', 'GET', '/businesses/1', None, 200, 1),
+    ('get_businesses', 'GET', '/businesses', None, 200, 1),
+    ('get_review', 'GET', '/reviews/1', None, 200, 1),
+    ('get_owners_businesses', 'GET', '/owners/7/businesses', None, 200, 1),
+    ('get_users_reviews', 'GET', '/users/1/reviews', None, 200, 1),
+    ('get_business_stats', 'GET', '/businesses/1/stats', None, 200, 1),
+    ('get_businesses_by_id', 'GET', '/businesses?ids=1,2,3', None, 200, 1),
+    ('get_business_expand_reviews', 'GET', '/businesses/1?expand=reviews', None, 200, 2),
+    ('get_review_expand_business', 'GET', '/reviews/1?expand=business', None, 200, 2),
+    ('get_users_reviews_expand_business', 'GET', '/users/1/reviews?expand=business', None, 200, 1),
+    ('delete_review', 'DELETE', '/reviews/1', None, 204, 2),
+    ('delete_review_missing', 'DELETE', '/reviews/1', None, 404, 2),
+    ('delete_business', 'DELETE', '/businesses/1', None, 204, 2),
+]
+
+
+@contextlib.contextmanager
+def count_statements(engine: sqlalchemy.engine.base.Engine):
+    """Yields a list that collects every statement the engine executes."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', record)
+
+
+def main_cli() -> int:
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'budget.db')}"
+
+    import main
+    from migrations import migrate
+
+    main.init_db()
+    main.create_table(main.db)
+    main.create_reviews_table(main.db)
+    main.create_business_stats_table(main.db)
+    migrate(main.db)
+    client = main.app.test_client()
+
+    failures = 0
+    for name, method, path, body, expected_status, budget in CHECKS:
+        main.cache.backend.clear()
+        with count_statements(main.db) as statements:
+            response = client.open(path, method=method, json=body)
+        ok = response.status_code == expected_status and len(statements) <= budget
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<32} status {response.status_code} "
+              f"(expected {expected_status}), {len(statements)} statements (budget {budget})")
+        if not ok:
+            for statement in statements:
+                print(f'       {" ".join(statement.split())}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,101 @@
+"""
+Checks the query plan of each filter and sort combination of GET /businesses.
+
+    python -m bench.query_plans
+
+Every request in CHECKS runs once, and the statement that reads the page is
+run again under EXPLAIN. A check fails if the plan does not use one of the
+indexes it names, which usually means a filter lost its index and now scans
+the table. It also fails if the plan sorts the rows when the check expects
+them to be read in page order, so that a page stops reading at its LIMIT.
+The plans are printed either way. The database is a scratch SQLite file
+unless DATABASE_URL points at another one, such as a MySQL copy.
+"""
+import contextlib
+import os
+import sys
+import tempfile
+
+import sqlalchemy
+
+from profiling import EXPLAIN_PREFIX
+
+# (name, query string, indexes of which the plan must use one, whether the
+# plan may sort the rows). Without an index the check only asks for rows read
+# in page order: the primary key walk of an unfiltered page, or of a filter
+# no index leads with, stops as soon as the page is full.
+CHECKS = [
+    ('no filter', '', (), False),
+    ('after cursor', 'cursor=WzJd', ('PRIMARY',), False),
+    # (state, city) is ordered by city first, so a state's businesses are sorted by id
+    ('state', 'state=WA', ('idx_businesses_state_city',), True),
+    ('state and city', 'state=WA&city=Seattle', ('idx_businesses_state_city',), False),
+    ('city', 'city=Seattle', (), False),
+    ('zip_code', 'zip_code=98101', ('idx_businesses_zip_code',), False),
+    ('owner_id', 'owner_id=7', ('idx_businesses_owner_id',), False),
+    ('state and owner_id', 'state=WA&owner_id=7', ('idx_businesses_owner_id', 'idx_businesses_state_city'), True),
+    # Walks businesses in id order, reading each stats row by its key
+    ('min_stars', 'min_stars=4', ('PRIMARY', 'sqlite_autoindex_business_stats_1'), False),
+    ('sort by rating', 'sort=rating', ('idx_business_stats_rating',), False),
+    ('sort by rating after cursor', 'sort=rating&cursor=WzQuMiw5Ml0', ('idx_business_stats_rating',), False),
+    ('min_stars by rating', 'min_stars=4&sort=rating', ('idx_business_stats_rating',), False),
+    # A filtered page sorts only the filter's matches by rating
+    ('state and city by rating', 'state=WA&city=Seattle&sort=rating', ('idx_businesses_state_city',), True),
+    ('zip_code by rating', 'zip_code=98101&sort=rating', ('idx_businesses_zip_code',), True),
+    ('owner_id by rating', 'owner_id=7&sort=rating', ('idx_businesses_owner_id',), True),
+    ('state, min_stars by rating', 'state=WA&min_stars=4&sort=rating', ('idx_businesses_state_city',), True),
+]
+
+# How SQLite and MySQL show a sort step in a plan
+SORT_MARKERS = ('TEMP B-TREE', 'Using filesort')
+
+
+@contextlib.contextmanager
+def capture_statements(engine: sqlalchemy.engine.base.Engine):
+    """Yields a list that collects the (statement, parameters) the engine executes."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', record)
+
+
+def main_cli() -> int:
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+
+    import main
+
+    main.ensure_db()
+    client = main.app.test_client()
+    prefix = EXPLAIN_PREFIX[main.db.dialect.name]
+
+    failures = 0
+    for name, query, indexes, may_sort in CHECKS:
+        main.cache.backend.clear()
+        with capture_statements(main.db) as statements:
+            response = client.get(f'/businesses?{query}')
+        # The page is read by the last statement
+        statement, parameters = statements[-1]
+        with main.db.connect() as conn:
+            plan = conn.exec_driver_sql(prefix + statement, parameters).all()
+        lines = [' | '.join(str(column) for column in row) for row in plan]
+        uses_index = not indexes or any(index in line for index in indexes for line in lines)
+        sorts = any(marker in line for marker in SORT_MARKERS for line in lines)
+        ok = response.status_code == 200 and uses_index and (may_sort or not sorts)
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<32} status {response.status_code}"
+              + (f", expects {' or '.join(indexes)}" if indexes else '')
+              + ('' if may_sort else ', in page order'))
+        for line in lines:
+            print(f'       {line}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,114 @@
+"""
+Checks read replica routing and its fallback with two local SQLite files.
+
+    python -m bench.replica_routing
+
+The primary and the replica are scratch files with the same schema. Their
+copies of business 1 differ, so each response tells which one served it.
+Nothing replicates between the files: the script writes the replica's
+heartbeat row itself to make it healthy or lagging, then runs a check of
+the router and a few requests. It also checks that a row read from the
+replica is cached for no longer than the lag threshold. The script exits
+with status 1 if any request is served by the wrong database.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+from replicas import HEARTBEAT_WRITE
+
+BUSINESS = {'owner_id': 7, 'name': 'Primary Cafe', 'street_address': '1 Main St',
+            'city': 'Seattle', 'state': 'WA', 'zip_code': 98101}
+REPLICA_NAME = 'Replica Cafe'
+MAX_LAG = 10
+
+
+def write_replica(replica: sqlalchemy.engine.base.Engine, statement: str, params: dict) -> None:
+    with replica.connect() as conn:
+        conn.execute(sqlalchemy.text(statement), params)
+        conn.commit()
+
+
+def main_cli() -> int:
+    workdir = tempfile.mkdtemp()
+    replica_path = os.path.join(workdir, 'replica.db')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'primary.db')}"
+    os.environ['REPLICA_DATABASE_URLS'] = f'sqlite:///{replica_path}'
+    os.environ['REPLICA_MAX_LAG_SECONDS'] = str(MAX_LAG)
+    # The script runs every check itself
+    os.environ['REPLICA_CHECK_SECONDS'] = '3600'
+
+    import main
+
+    main.ensure_db()
+    router = main.router
+    replica = router.replicas[0]
+    main.prepare_schema(replica)
+    # The write sets the read_primary cookie on its client, so other reads use another
+    writer = main.app.test_client()
+    writer.post('/businesses', json=BUSINESS)
+    reader = main.app.test_client()
+    write_replica(replica,
+                  'INSERT INTO businesses (business_id, owner_id, name, street_address, city, state, zip_code) '
+                  'VALUES (1, :owner_id, :name, :street_address, :city, :state, :zip_code)',
+                  dict(BUSINESS, name=REPLICA_NAME))
+    # The background check runs once when started; later checks are made below
+    router.start()
+    time.sleep(0.1)
+
+    def served_by(client, headers=None) -> str:
+        response = client.get('/businesses/1', headers=headers or {})
+        name = response.get_json()['name']
+        return 'replica' if name == REPLICA_NAME else 'primary'
+
+    def beat(age: float) -> None:
+        write_replica(replica, HEARTBEAT_WRITE.text, {'beat_at': time.time() - age})
+        router.check()
+
+    def check_missing() -> None:
+        replica.dispose()
+        os.remove(replica_path)
+        router.check()
+
+    # (name, how to set the replica up, client, request headers, expected state, expected database)
+    checks = [
+        ('healthy replica', lambda: beat(0), reader, None, 'healthy', 'replica'),
+        ('healthy, X-Read-Primary', lambda: None, reader, {main.READ_PRIMARY_HEADER: '1'}, 'healthy', 'primary'),
+        ('healthy, read_primary cookie', lambda: None, writer, None, 'healthy', 'primary'),
+        ('lagging replica', lambda: beat(MAX_LAG + 5), reader, None, 'lagging', 'primary'),
+        ('caught up again', lambda: beat(1), reader, None, 'healthy', 'replica'),
+        ('missing replica', check_missing, reader, None, 'unreachable', 'primary'),
+    ]
+
+    # A replica's copy is cached, for no longer than the replica may lag
+    beat(0)
+    main.cache.backend.clear()
+    served_by(reader)
+    hits = main.cache.hits
+    cached = served_by(reader)
+    _, expires_at = main.cache.backend._entries['business:1']
+    ttl = expires_at - time.monotonic()
+    ok = cached == 'replica' and main.cache.hits == hits + 1 and ttl <= MAX_LAG
+    failures = int(not ok)
+    print(f"{'ok  ' if ok else 'FAIL'} {'cached replica read':<30} served by {cached} (expected replica), "
+          f"{main.cache.hits - hits} cache hit (expected 1), ttl {ttl:.1f} s (at most {MAX_LAG})")
+
+    for name, setup, client, headers, state, expected in checks:
+        setup()
+        main.cache.backend.clear()
+        actual = served_by(client, headers)
+        # A read-your-writes client must not be answered from a replica's cached copy
+        after_replica_read = served_by(reader, {main.READ_PRIMARY_HEADER: '1'})
+        ok = router.state[0] == state and actual == expected and after_replica_read == 'primary'
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<30} replica {router.state[0]} (expected {state}), "
+              f"served by {actual} (expected {expected}), then {after_replica_read} for X-Read-Primary")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
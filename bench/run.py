@@ -0,0 +1,264 @@
+"""
+Drives a weighted mix of requests against the app and reports per-route
+latency percentiles and throughput.
+
+    DATABASE_URL=sqlite:///bench.db python -m bench.run --scenario bench/scenarios/mixed.jsonl
+
+By default requests go through the Flask test client in this process, against
+DATABASE_URL. With --target they are sent over HTTP to a running server
+instead. Every run is written to --results-dir as JSON for bench.compare.
+
+A scenario is a JSON Lines file with one request template per line:
+
+    {"name": "get_business", "method": "GET", "path": "/businesses/{business_id}", "weight": 30}
+
+`body` is optional. `{business_id}`, `{review_id}`, `{owner_id}` and
+`{user_id}` are replaced with random ids from the seeded ranges, and
+`{new_user_id}` with a user id that has no reviews yet. A body value that is
+exactly one placeholder becomes an integer.
+"""
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import urllib.parse
+
+import sqlalchemy
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+def load_scenario(path: str) -> list:
+    entries = []
+    with open(path) as scenario:
+        for line in scenario:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line)
+            entry.setdefault('weight', 1)
+            entry.setdefault('body', None)
+            entries.append(entry)
+    if not entries:
+        raise SystemExit(f'{path} has no requests')
+    return entries
+
+
+class IdSource:
+    """Picks ids for scenario placeholders from the seeded ranges."""
+
+    def __init__(self, ranges: dict):
+        self.ranges = ranges
+        self._new_users = itertools.count(ranges['user_id'] + 1)
+        self._lock = threading.Lock()
+
+    def value(self, name: str, rng: random.Random) -> int:
+        if name == 'new_user_id':
+            with self._lock:
+                return next(self._new_users)
+        return rng.randint(1, max(1, self.ranges[name]))
+
+
+def id_ranges(db: sqlalchemy.engine.base.Engine) -> dict:
+    with db.connect() as conn:
+        row = conn.execute(sqlalchemy.text(
+            'SELECT (SELECT MAX(business_id) FROM businesses), (SELECT MAX(owner_id) FROM businesses), '
+            '(SELECT MAX(review_id) FROM reviews), (SELECT MAX(user_id) FROM reviews)'
+        )).one()
+    return {'business_id': row[0] or 0, 'owner_id': row[1] or 0,
+            'review_id': row[2] or 0, 'user_id': row[3] or 0}
+
+
+def render(entry: dict, ids: IdSource, rng: random.Random):
+    values = {}
+
+    def fill(match):
+        name = match.group(1)
+        if name not in values:
+            values[name] = ids.value(name, rng)
+        return str(values[name])
+
+    path = PLACEHOLDER.sub(fill, entry['path'])
+    body = entry['body']
+    if body is not None:
+        body = {key: (int(fill(PLACEHOLDER.fullmatch(value)))
+                      if isinstance(value, str) and PLACEHOLDER.fullmatch(value)
+                      else PLACEHOLDER.sub(fill, value) if isinstance(value, str) else value)
+                for key, value in body.items()}
+    return entry['method'], path, body
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, body) -> int:
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPTransport:
+    def __init__(self, target: str):
+        parsed = urllib.parse.urlsplit(target)
+        self.connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+
+    def send(self, method, path, body) -> int:
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        self.connection.request(method, path, body=payload, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run(entries: list, make_transport, ids: IdSource, requests: int, concurrency: int,
+        rng_seed: int, warmup: int = 0) -> dict:
+    names = [entry['name'] for entry in entries]
+    weights = [entry['weight'] for entry in entries]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(index: int, count: int, record: bool):
+        rng = random.Random(rng_seed * 1000 + index)
+        transport = make_transport()
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        for entry in rng.choices(entries, weights=weights, k=count):
+            method, path, body = render(entry, ids, rng)
+            started = time.perf_counter()
+            try:
+                status = transport.send(method, path, body)
+            except Exception:
+                status = 599
+            local[entry['name']].append(time.perf_counter() - started)
+            if status >= 500:
+                local_errors[entry['name']] += 1
+        if record:
+            with lock:
+                for name in names:
+                    samples[name].extend(local[name])
+                    errors[name] += local_errors[name]
+
+    def phase(counts, record):
+        threads = [threading.Thread(target=worker, args=(i, count, record))
+                   for i, count in enumerate(counts)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    if warmup:
+        phase([warmup // concurrency or 1] * concurrency, record=False)
+    elapsed = phase(per_worker, record=True)
+
+    routes = {}
+    for name in names:
+        values = sorted(samples[name])
+        if not values:
+            continue
+        routes[name] = {
+            'count': len(values),
+            'errors': errors[name],
+            'rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        }
+    every = sorted(value for values in samples.values() for value in values)
+    total = {
+        'count': len(every),
+        'errors': sum(errors.values()),
+        'rps': round(len(every) / elapsed, 2),
+        'elapsed_s': round(elapsed, 3),
+        'p50_ms': round(percentile(every, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(every, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(every, 0.99) * 1000, 3),
+    }
+    return {'routes': routes, 'total': total}
+
+
+def print_report(report: dict) -> None:
+    print(f"{'route':<28}{'count':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(report['routes'].items()) + [('TOTAL', report['total'])]
+    for name, stats in rows:
+        print(f"{name:<28}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>10.1f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default=os.path.join(os.path.dirname(__file__), 'scenarios', 'mixed.jsonl'))
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--target', help='base URL of a running server, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--results-dir', default=os.path.join(os.path.dirname(__file__), 'results'))
+    args = parser.parse_args()
+
+    import main
+
+    main.init_db()
+    entries = load_scenario(args.scenario)
+    ranges = id_ranges(main.db)
+    ids = IdSource(ranges)
+    if args.target:
+        make_transport = lambda: HTTPTransport(args.target)
+    else:
+        make_transport = lambda: TestClientTransport(main.app)
+
+    report = run(entries, make_transport, ids, args.requests, args.concurrency, args.seed, args.warmup)
+    report.update({
+        'label': args.label,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'database': main.db.dialect.name,
+        'target': args.target or 'in-process',
+        'scenario': os.path.basename(args.scenario),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'dataset': ranges,
+    })
+    print_report(report)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = report['timestamp'].replace(':', '').replace('-', '')
+    path = os.path.join(args.results_dir, f"{stamp}-{args.label}.json")
+    with open(path, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print(f'Saved {path}')
+
+
+if __name__ == '__main__':
+    main_cli()
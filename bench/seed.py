@@ -0,0 +1,101 @@
+"""
+Seeds an empty local database with a reproducible dataset.
+
+    DATABASE_URL=sqlite:///bench.db python -m bench.seed --businesses 1000000 --reviews 10000000
+
+Business ids run from 1 to --businesses. Every user reviews a business at
+most once, so the data also satisfies a UNIQUE (business_id, user_id).
+"""
+import argparse
+import random
+import time
+
+import sqlalchemy
+
+import main
+from migrations import migrate
+
+CITIES = [('Seattle', 'WA'), ('Portland', 'OR'), ('Boise', 'ID'), ('Spokane', 'WA'),
+          ('Eugene', 'OR'), ('Tacoma', 'WA'), ('Bend', 'OR'), ('Olympia', 'WA')]
+WORDS = ['great', 'food', 'slow', 'friendly', 'service', 'cheap', 'clean', 'loud',
+         'coffee', 'staff', 'parking', 'fresh', 'tasty', 'busy', 'cozy', 'rude']
+
+
+def seed(db: sqlalchemy.engine.base.Engine, businesses: int, reviews: int, owners: int,
+         users: int, rng_seed: int = 42, chunk_size: int = 5000) -> None:
+    rng = random.Random(rng_seed)
+    main.create_table(db)
+    main.create_reviews_table(db)
+    with db.connect() as conn:
+        if conn.execute(sqlalchemy.text('SELECT COUNT(*) FROM businesses')).scalar():
+            raise SystemExit('The businesses table is not empty; seed a fresh database')
+
+        business_stmt = sqlalchemy.text(
+            'INSERT INTO businesses(owner_id, name, street_address, city, state, zip_code) '
+            'VALUES (:owner_id, :name, :street_address, :city, :state, :zip_code)'
+        )
+        for chunk in main.chunked(range(businesses), chunk_size):
+            rows = []
+            for i in chunk:
+                city, state = CITIES[rng.randrange(len(CITIES))]
+                rows.append({'owner_id': rng.randint(1, owners),
+                             'name': f'Business {i + 1}',
+                             'street_address': f'{rng.randint(1, 9999)} Main St',
+                             'city': city,
+                             'state': state,
+                             'zip_code': rng.randint(10000, 99999)})
+            conn.execute(business_stmt, rows)
+            conn.commit()
+
+        # Review i belongs to user i % users and to that user's (i // users)th
+        # business, which keeps (user_id, business_id) pairs unique.
+        review_stmt = sqlalchemy.text(
+            'INSERT INTO reviews (user_id, business_id, stars, review_text) '
+            'VALUES (:user_id, :business_id, :stars, :review_text)'
+        )
+        for chunk in main.chunked(range(reviews), chunk_size):
+            rows = []
+            for i in chunk:
+                user = i % users
+                rows.append({'user_id': user + 1,
+                             'business_id': (user * 7919 + i // users) % businesses + 1,
+                             'stars': rng.randint(1, 5),
+                             'review_text': ' '.join(rng.choices(WORDS, k=rng.randint(0, 12)))})
+            conn.execute(review_stmt, rows)
+            conn.commit()
+
+    # Built last so the secondary indexes of a fresh database are built once
+    # rather than maintained per insert. A database the app has already set
+    # up has its stats table and migrations, so the stats rows of the seeded
+    # businesses are filled in here.
+    main.create_business_stats_table(db)
+    with db.connect() as conn:
+        main.fill_business_stats(conn)
+        conn.commit()
+    migrate(db)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--businesses', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--owners', type=int, default=None, help='defaults to businesses / 10')
+    parser.add_argument('--users', type=int, default=None, help='defaults to reviews / 10')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    owners = args.owners or max(1, args.businesses // 10)
+    users = args.users or max(1, args.reviews // 10)
+    if args.reviews > users * args.businesses:
+        parser.error('--reviews must not exceed users * businesses')
+
+    main.init_db()
+    started = time.perf_counter()
+    seed(main.db, args.businesses, args.reviews, owners, users, args.seed, args.chunk_size)
+    print(f'Seeded {args.businesses} businesses and {args.reviews} reviews '
+          f'in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,117 @@
+import collections
+import threading
+import time
+
+
+class CacheBackend:
+    """
+    Storage interface used by RowCache.
+
+    Keys are strings and values are JSON-compatible dicts, so an
+    implementation can keep them in process memory or in a store shared by
+    several gunicorn workers.
+    """
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: dict, ttl: float = None) -> None:
+        """Stores `value`, for at most `ttl` seconds when given."""
+        raise NotImplementedError
+
+    def delete_many(self, keys) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LRUTTLBackend(CacheBackend):
+    """
+    Bounded in-process store. Entries expire `ttl` seconds after they were
+    written and the least recently used entry is evicted once `max_entries`
+    is reached. A `max_entries` of 0 disables caching.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, ttl: float = None) -> None:
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RowCache:
+    """
+    Read-through cache of the row dicts built by the single-resource GET
+    handlers. Callers get a copy, so adding request specific fields such as
+    `self` never alters the cached entry.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # `+=` on an attribute is not atomic across request threads
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return dict(value) if value is not None else None
+
+    def set(self, key: str, value: dict, ttl: float = None) -> None:
+        self.backend.set(key, dict(value), ttl)
+
+    def invalidate(self, *keys: str) -> None:
+        self.backend.delete_many(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def business_key(business_id) -> str:
+    return f'business:{business_id}'
+
+
+def review_key(review_id) -> str:
+    return f'review:{review_id}'
@@ -0,0 +1,85 @@
+"""
+Negotiated gzip and brotli compression of JSON responses.
+
+A response is compressed when the client's Accept-Encoding allows it, its
+body is JSON or NDJSON of at least COMPRESS_MIN_BYTES, and it carries no
+strong ETag. Brotli is preferred when the `brotli` package is installed and
+the client accepts it equally. Streamed list responses are compressed as
+they are written, flushing after each batch of rows so the client still
+receives rows as they are read.
+
+Strong ETags name the exact bytes of a single business or review, and If-Match
+compares them strongly, so those responses are left as they are. They are
+far below the size threshold anyway. The collections that benefit carry
+weak ETags or none.
+"""
+import gzip
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+# Brotli's higher qualities are meant for static files and cost too much CPU per request
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson')
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+# Closes `chunks` when done, so a streamed query releases its connection even
+# if the client goes away
+def compress_stream(chunks, encoding: str):
+    try:
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        else:
+            # wbits 31 writes the gzip header and trailer
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def after_request(response):
+    if (request.method == 'HEAD' or response.status_code != 200 or response.mimetype not in COMPRESSIBLE
+            or 'Content-Encoding' in response.headers):
+        return response
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        return response
+    if not response.is_streamed and len(response.get_data()) < COMPRESS_MIN_BYTES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def instrument_app(app) -> None:
+    app.after_request(after_request)
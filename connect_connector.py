@@ -14,25 +14,33 @@
 
 # [START cloud_sql_mysql_sqlalchemy_connect_connector]
 import os
+import threading
 
-from google.cloud.sql.connector import Connector, IPTypes
 import pymysql
+from pymysql.constants import CLIENT
 
 import sqlalchemy
 
 
-def connect_with_connector() -> sqlalchemy.engine.base.Engine:
+def connect_with_connector(instance_connection_name: str = None) -> sqlalchemy.engine.base.Engine:
     """
     Initializes a connection pool for a Cloud SQL instance of MySQL.
 
-    Uses the Cloud SQL Python Connector package.
+    Uses the Cloud SQL Python Connector package. The instance defaults to
+    INSTANCE_CONNECTION_NAME; read replicas pass their own.
+
+    The connector package is imported here rather than at module level, and
+    the Connector is created when the pool opens its first connection, so
+    neither slows down importing the app.
     """
+    from google.cloud.sql.connector import Connector, IPTypes
+
     # Note: Saving credentials in environment variables is convenient, but not
     # secure - consider a more secure solution such as
     # Cloud Secret Manager (https://cloud.google.com/secret-manager) to help
     # keep secrets safe.
 
-    instance_connection_name = os.environ[
+    instance_connection_name = instance_connection_name or os.environ[
         "INSTANCE_CONNECTION_NAME"
     ]  # e.g. 'project:region:instance'
     db_user = os.environ["DB_USER"]  # e.g. 'my-db-user'
@@ -41,15 +49,25 @@ def connect_with_connector() -> sqlalchemy.engine.base.Engine:
 
     ip_type = IPTypes.PRIVATE if os.environ.get("PRIVATE_IP") else IPTypes.PUBLIC
 
-    connector = Connector(ip_type)
+    connector = None
+    connector_lock = threading.Lock()
 
     def getconn() -> pymysql.connections.Connection:
+        nonlocal connector
+        if connector is None:
+            with connector_lock:
+                if connector is None:
+                    connector = Connector(ip_type)
         conn: pymysql.connections.Connection = connector.connect(
             instance_connection_name,
             "pymysql",
             user=db_user,
             password=db_pass,
             db=db_name,
+            # Report rows matched rather than rows changed for UPDATE, as
+            # SQLAlchemy's own MySQL dialects do, so an UPDATE that writes the
+            # same values still counts the row it found.
+            client_flag=CLIENT.FOUND_ROWS,
         )
         return conn
 
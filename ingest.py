@@ -0,0 +1,186 @@
+"""
+Write-behind queue for review submissions.
+
+With REVIEW_INGEST_WORKERS set above 0, POST /reviews validates the review,
+puts it on a bounded in-process queue and answers 202 with a status URL.
+Worker threads take up to REVIEW_INGEST_BATCH_SIZE queued reviews at a
+time and write each batch in one transaction, in the same way as
+POST /reviews:batch. A full queue (REVIEW_INGEST_QUEUE_SIZE entries) turns
+submissions away with 429 until the workers catch up.
+
+Ordering: reviews are taken from the queue in the order they were accepted.
+With one worker they are written in that order. With several, batches are
+written concurrently, so review ids only follow submission order within a
+batch.
+
+Delivery: a batch that fails with a database error is retried, with
+backoff, up to REVIEW_INGEST_MAX_ATTEMPTS times before its reviews are
+reported as failed. The unique (business_id, user_id) index keeps a retry
+from storing a review twice; a review whose first attempt committed before
+the error reports 409 on the retry. The queue lives in memory: at exit the
+process waits up to REVIEW_INGEST_DRAIN_SECONDS for it to empty, and
+reviews still queued after that, or on a crash, are lost. An accepted
+review is therefore written at most once across process loss.
+
+Statuses: each batch's results are recorded in the review_ingest_results
+table after the batch commits, and kept there for
+REVIEW_INGEST_RESULT_SECONDS, so any worker can answer for a ticket. The
+accepting process also keeps the last REVIEW_INGEST_STATUS_RETENTION
+in memory. A ticket carries the time it was issued. One with no recorded
+result is reported as queued for REVIEW_INGEST_PENDING_SECONDS after that
+time, since the worker holding it may still be writing it, and as unknown
+afterwards. A review lost with its process, or written just before a crash
+that kept its result from being recorded, goes the same way.
+"""
+import atexit
+import collections
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger()
+
+QUEUED = 'queued'
+DONE = 'done'
+
+
+# Tickets start with the time they were issued, in milliseconds as 12 hex digits
+TICKET_TIME_DIGITS = 12
+
+
+def new_ticket() -> str:
+    return f'{time.time_ns() // 1000000:0{TICKET_TIME_DIGITS}x}{uuid.uuid4().hex[TICKET_TIME_DIGITS:]}'
+
+
+def ticket_issued_at(ticket: str):
+    """The time `ticket` was issued, or None if it is not a ticket."""
+    if len(ticket) != 32:
+        return None
+    try:
+        int(ticket, 16)
+    except ValueError:
+        return None
+    return int(ticket[:TICKET_TIME_DIGITS], 16) / 1000
+
+
+class IngestQueue:
+    def __init__(self, write_batch, capacity: int, workers: int, batch_size: int,
+                 max_attempts: int = 5, retention: int = 10000, retry_seconds: float = 0.5,
+                 drain_seconds: float = 10.0, record=None, lookup=None, pending_seconds: float = 300.0):
+        # write_batch(items) returns one result dict per item, or raises to
+        # have the whole batch retried
+        self.write_batch = write_batch
+        # record(entries) stores (ticket, result) pairs where every process can
+        # read them, and lookup(ticket) returns a stored result or None
+        self.record = record
+        self.lookup = lookup
+        self.pending_seconds = pending_seconds
+        self.queue = queue.Queue(maxsize=capacity)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.retry_seconds = retry_seconds
+        self.drain_seconds = drain_seconds
+        self.pending = set()
+        self.finished = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, item) -> str:
+        """Queues `item` and returns its ticket, or None if the queue is full."""
+        if not self.threads:
+            self.start()
+        ticket = new_ticket()
+        with self.lock:
+            self.pending.add(ticket)
+        try:
+            self.queue.put_nowait((ticket, item))
+        except queue.Full:
+            with self.lock:
+                self.pending.discard(ticket)
+            return None
+        return ticket
+
+    def status(self, ticket: str):
+        """Returns (QUEUED, None), (DONE, result) or None for an unknown ticket."""
+        with self.lock:
+            if ticket in self.pending:
+                return QUEUED, None
+            if ticket in self.finished:
+                return DONE, self.finished[ticket]
+        issued_at = ticket_issued_at(ticket)
+        if issued_at is None:
+            return None
+        result = self.lookup(ticket) if self.lookup is not None else None
+        if result is not None:
+            return DONE, result
+        # Another process may still hold the review
+        if 0 <= time.time() - issued_at <= self.pending_seconds:
+            return QUEUED, None
+        return None
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    # The threads start with the first submission, so each forked worker runs its own
+    def start(self) -> None:
+        with self.lock:
+            if self.threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.run, name=f'review-ingest-{number}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        atexit.register(self.drain)
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, batch: list) -> None:
+        items = [item for _, item in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                results = self.write_batch(items)
+                break
+            except Exception as e:
+                logger.warning('Review ingest batch of %d failed (attempt %d of %d): %s',
+                               len(batch), attempt, self.max_attempts, e)
+                if attempt < self.max_attempts:
+                    time.sleep(self.retry_seconds * 2 ** (attempt - 1))
+        else:
+            results = [{'status': 500, 'Error': 'Unable to create review'}] * len(batch)
+        if self.record is not None:
+            try:
+                self.record([(ticket, result) for (ticket, _), result in zip(batch, results)])
+            except Exception as e:
+                logger.warning('Unable to record the results of a review ingest batch of %d: %s', len(batch), e)
+        with self.lock:
+            for (ticket, _), result in zip(batch, results):
+                self.pending.discard(ticket)
+                self.finished[ticket] = result
+            while len(self.finished) > self.retention:
+                self.finished.popitem(last=False)
+
+    def drain(self, timeout: float = None) -> bool:
+        """Waits up to `timeout` seconds for the queue to empty and tells whether it did."""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.drain_seconds)
+        while self.queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                logger.warning('%d queued reviews are still unwritten', self.queue.unfinished_tasks)
+                return False
+            time.sleep(0.05)
+        return True
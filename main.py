@@ -1,46 +1,427 @@
 from __future__ import annotations
-from flask import Flask, request, jsonify 
+import time
+IMPORT_STARTED = time.perf_counter()
+from flask import Flask, g, request, jsonify 
+from werkzeug.middleware.proxy_fix import ProxyFix
 from connect_connector import connect_with_connector
+from connect_local import connect_with_url
+from replicas import ReplicaRouter
+from pagination import decode_cursor, encode_cursor
+from migrations import migrate, schema_is_current
+from cache import LRUTTLBackend, RowCache, business_key, review_key
+from streaming import requested_encoding, stream_query
+from models import Business, FieldSet, Review
+from serializer import json_response
+from search import InvertedIndex
+import ingest
+import admission
+import compression
+import metrics
+import profiling
+import singleflight
+import statements
 from flask import Flask, request
+import contextlib
+import hashlib
+import hmac
 import logging
 import os
+import threading
+import urllib.parse
 import sqlalchemy
 from sqlalchemy import text
-from google.cloud.sql.connector import Connector, IPTypes
 
 # Set up variables
 BUSINESS = 'Business'
 ERORR_NOT_FOUND = {"Error" : "No business with this business_id exists"}
 ERORR_NOT_FOUND_REVIEW = {"Error" : "No review with this review_id exists"}
+ERROR_MISSING_ATTRIBUTES = "The request body is missing at least one of the required attributes"
+ERROR_INVALID_STARS = "stars must be an integer from 1 to 5"
+ERROR_DUPLICATE_REVIEW = "You have already submitted a review for this business. You can update your previous review, or delete it and submit a new review"
+ERROR_PRECONDITION_FAILED = "The resource has changed since the version named in If-Match"
+BUSINESS_FIELDS = ['owner_id', 'name', 'street_address', 'city', 'state', 'zip_code']
+REVIEW_FIELDS = ['user_id', 'business_id', 'stars']
+# The most characters each VARCHAR column holds; the other business fields are INT
+BUSINESS_FIELD_LENGTHS = {'name': 50, 'street_address': 100, 'city': 50, 'state': 2}
+REVIEW_TEXT_MAX_LENGTH = 1000
+ERROR_INVALID_REVIEW_TEXT = f"review_text must be null or a string of at most {REVIEW_TEXT_MAX_LENGTH} characters"
+INT_RANGE = (-2 ** 31, 2 ** 31 - 1)
+BIGINT_UNSIGNED_RANGE = (0, 2 ** 64 - 1)
+
+# Limits for the batch endpoints. Items are inserted in chunks of
+# BATCH_CHUNK_SIZE rows, each chunk in its own transaction.
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 5000))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 500))
+
+# Most ids one GET /businesses?ids= request may name
+MULTI_GET_MAX_IDS = int(os.environ.get('MULTI_GET_MAX_IDS', 100))
+# Reviews GET /businesses/<id>?expand=reviews embeds, by default and at most
+EXPAND_REVIEWS_LIMIT = 10
+EXPAND_REVIEWS_MAX_LIMIT = 100
+
+# Write-behind review ingestion, off unless REVIEW_INGEST_WORKERS is above 0.
+# See ingest.py for the ordering and delivery guarantees.
+REVIEW_INGEST_WORKERS = int(os.environ.get('REVIEW_INGEST_WORKERS', 0))
+REVIEW_INGEST_QUEUE_SIZE = int(os.environ.get('REVIEW_INGEST_QUEUE_SIZE', 2000))
+REVIEW_INGEST_BATCH_SIZE = int(os.environ.get('REVIEW_INGEST_BATCH_SIZE', 200))
+REVIEW_INGEST_MAX_ATTEMPTS = int(os.environ.get('REVIEW_INGEST_MAX_ATTEMPTS', 5))
+REVIEW_INGEST_STATUS_RETENTION = int(os.environ.get('REVIEW_INGEST_STATUS_RETENTION', 10000))
+REVIEW_INGEST_DRAIN_SECONDS = float(os.environ.get('REVIEW_INGEST_DRAIN_SECONDS', 10))
+REVIEW_INGEST_PENDING_SECONDS = float(os.environ.get('REVIEW_INGEST_PENDING_SECONDS', 300))
+# Age in seconds after which results are deleted from review_ingest_results
+REVIEW_INGEST_RESULT_SECONDS = float(os.environ.get('REVIEW_INGEST_RESULT_SECONDS', 86400))
+
+# Rows fetched per round trip when a list endpoint streams its response
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+
+# Proxies in front of the app that append to X-Forwarded-For. The App Engine
+# front end is one, so there the client address is the last entry it added.
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 1 if os.environ.get('GAE_ENV') else 0))
 
 app = Flask(__name__)
 logger = logging.getLogger()
 
+# request.remote_addr is the client's address rather than the proxy's, so
+# rate limits and logs see each client apart
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+# Read-through cache for get_business and get_review. Entries are dropped by
+# the handlers that change or delete the row; CACHE_TTL_SECONDS bounds how
+# long another worker's process-local copy can lag behind a write.
+cache = RowCache(LRUTTLBackend(
+    max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 10000)),
+    ttl=float(os.environ.get('CACHE_TTL_SECONDS', 60)),
+))
+
+# Request, query and pool metrics, served at /metrics
+metrics.instrument_app(app)
+metrics.registry.add(metrics.Gauge('row_cache_hits_total', 'Row cache lookups that found an entry.',
+                                   lambda: cache.hits, kind='counter'))
+metrics.registry.add(metrics.Gauge('row_cache_misses_total', 'Row cache lookups that missed.',
+                                   lambda: cache.misses, kind='counter'))
+
+# gzip and brotli for larger JSON responses
+compression.instrument_app(app)
+
+# Sampling profiler and slow query log, off unless configured
+profiling.instrument_app(app)
+
+for phase in ('import', 'init', 'first_request'):
+    metrics.registry.add(metrics.Gauge(f'app_startup_{phase}_seconds', f'Cold start: {phase} time of this worker.',
+                                       lambda phase=phase: startup_seconds[phase]))
+
 # Sets up connection pool for the app
 def init_connection_pool() -> sqlalchemy.engine.base.Engine:
     if os.environ.get('INSTANCE_CONNECTION_NAME'):
         return connect_with_connector()
+    if os.environ.get('DATABASE_URL'):
+        return connect_with_url()
         
     raise ValueError(
-        'Missing database connection type. Please define INSTANCE_CONNECTION_NAME'
+        'Missing database connection type. Please define INSTANCE_CONNECTION_NAME or DATABASE_URL'
+    )
+
+# Sets up the read replica router, or returns None when no replicas are
+# configured. Replicas are named the same way as the primary, as Cloud SQL
+# instances or as URLs, in comma separated lists.
+def init_replica_router(primary: sqlalchemy.engine.base.Engine):
+    instance_names = [name for name in os.environ.get('REPLICA_INSTANCE_CONNECTION_NAMES', '').split(',') if name]
+    urls = [url for url in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if url]
+    if instance_names:
+        replicas = [connect_with_connector(name) for name in instance_names]
+    elif urls:
+        replicas = [connect_with_url(url) for url in urls]
+    else:
+        return None
+    return ReplicaRouter(
+        primary, replicas,
+        max_lag=float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10)),
+        check_interval=float(os.environ.get('REPLICA_CHECK_SECONDS', 2)),
     )
 
 # This global variable is declared with a value of `None`
 db = None
+router = None
+
+# Clients that must read their own writes send this header. Successful
+# writes also set this cookie for as long as a replica may lag behind.
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+READ_PRIMARY_COOKIE = 'read_primary'
+
+def reads_own_writes() -> bool:
+    return bool(request.headers.get(READ_PRIMARY_HEADER) or request.cookies.get(READ_PRIMARY_COOKIE))
+
+# Engine for the queries of a read-only handler
+def read_db() -> sqlalchemy.engine.base.Engine:
+    if router is None or reads_own_writes():
+        return db
+    return router.reader()
+
+# The row cache is shared by every client of the worker, and clients reading
+# their own writes skip it. A replica's copy of a row may predate a write, so
+# it is kept no longer than the replica may lag, and the writer's
+# read_primary cookie outlives it.
+def cached_row(key: str):
+    return None if reads_own_writes() else cache.get(key)
+
+def cache_row(engine: sqlalchemy.engine.base.Engine, key: str, fields: dict) -> None:
+    cache.set(key, fields, None if engine is db else replica_cache_ttl())
+
+def replica_cache_ttl() -> float:
+    return router.max_lag
+
+@app.after_request
+def mark_read_primary(response):
+    if (router is not None and request.method in ('POST', 'PUT', 'DELETE')
+            and response.status_code < 400):
+        # Covers the replica's lag and then the life of a copy cached from it
+        max_age = router.max_lag + router.check_interval + replica_cache_ttl()
+        response.set_cookie(READ_PRIMARY_COOKIE, '1', max_age=int(max_age) + 1, httponly=True)
+    return response
+
+# Splits a list into consecutive slices of at most `size` items
+def chunked(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Checks that a value is a JSON integer (not a boolean) within `bounds`
+def valid_int(value, bounds: tuple = INT_RANGE) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and bounds[0] <= value <= bounds[1]
+
+# Validates the body of a batch request, returning an error response or None
+def check_batch_body(content):
+    if not isinstance(content, list) or not content:
+        return jsonify({"Error": "The request body must be a non-empty JSON array"}), 400
+    if len(content) > BATCH_MAX_ITEMS:
+        return jsonify({"Error": f"A batch may contain at most {BATCH_MAX_ITEMS} items"}), 400
+    return None
+
+# Column definition of the auto-incrementing primary keys. The SQLite form is
+# used when DATABASE_URL points at a local stand-in database.
+AUTO_ID_COLUMN = {
+    'mysql': 'BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY',
+    'sqlite': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+}
+
+# Returns the id allocated to the first row of the last INSERT of `count` rows.
+# MySQL reports the first id of a multi-row INSERT, SQLite the last one.
+def first_inserted_id(conn, count: int = 1) -> int:
+    if conn.dialect.name == 'sqlite':
+        return conn.execute(text('SELECT last_insert_rowid()')).scalar() - count + 1
+    return conn.execute(text('SELECT LAST_INSERT_ID()')).scalar()
+
+# PyMySQL sends an executemany INSERT as one multi-row statement, but splits
+# it once it passes its max_stmt_length of 1,024,000 bytes, and LAST_INSERT_ID()
+# then names the first row of the last statement only. Rows are therefore
+# inserted in groups that stay one statement even with every byte escaped.
+INSERT_STATEMENT_MAX_BYTES = 500000
+
+# Splits row dicts into groups of at most `max_bytes` once sent as values
+def sized_groups(rows: list, max_bytes: int = INSERT_STATEMENT_MAX_BYTES):
+    group, size = [], 0
+    for row in rows:
+        # Escaping at most doubles a value; the rest covers quotes and separators
+        row_bytes = sum(2 * len(str(value).encode()) + 4 for value in row.values())
+        if group and size + row_bytes > max_bytes:
+            yield group
+            group, size = [], 0
+        group.append(row)
+        size += row_bytes
+    if group:
+        yield group
+
+# Inserts rows with executemany in the caller's transaction and returns their
+# ids, in order. Raises if the database reports another number of rows than
+# were sent, since the ids could not be trusted then.
+def insert_rows(conn, stmt, rows: list) -> list:
+    ids = []
+    for group in sized_groups(rows):
+        result = conn.execute(stmt, group)
+        if result.rowcount != len(group):
+            raise RuntimeError(f'Inserted {result.rowcount} rows of {len(group)}')
+        # A multi-row INSERT allocates consecutive ids
+        first_id = first_inserted_id(conn, len(group))
+        ids.extend(range(first_id, first_id + len(group)))
+    return ids
+
+# Row locking clause for read-then-write sequences. SQLite locks the whole
+# database for a write transaction and has no FOR UPDATE.
+def for_update(conn) -> str:
+    return '' if conn.dialect.name == 'sqlite' else ' FOR UPDATE'
+
+# Tells a unique key violation apart from other integrity errors
+def is_duplicate_key(error: sqlalchemy.exc.IntegrityError) -> bool:
+    if error.orig is not None and error.orig.args and error.orig.args[0] == 1062:
+        return True  # MySQL ER_DUP_ENTRY
+    return 'UNIQUE constraint failed' in str(error.orig)
 
-# Initiates connection to database
-def init_db():
-    global db
-    db = init_connection_pool()
+# Tells a foreign key violation, such as a review for a missing business,
+# apart from other integrity errors
+def is_missing_reference(error: sqlalchemy.exc.IntegrityError) -> bool:
+    if error.orig is not None and error.orig.args and error.orig.args[0] in (1216, 1452):
+        return True  # MySQL ER_NO_REFERENCED_ROW, ER_NO_REFERENCED_ROW_2
+    return 'FOREIGN KEY constraint failed' in str(error.orig)
+
+# ETags for single businesses and reviews are strong and built from the row's
+# version, which every UPDATE of the row increments
+def row_etag(kind: str, id: int, version: int) -> str:
+    return f'{kind}{id}.{version}'
+
+# Pages of a list are weak ETags over the (id, version) pairs of their rows
+def page_etag(versions) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for id, version in versions:
+        digest.update(f'{id}.{version},'.encode())
+    return digest.hexdigest()
+
+# Checks a conditional GET against the current ETag, using the weak
+# comparison If-None-Match calls for
+def client_has(etag: str) -> bool:
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified(etag: str, weak: bool = False):
+    response = app.response_class(status=304)
+    response.set_etag(etag, weak)
+    return response
+
+# Returns the row version an If-Match header requires, or None if the write is
+# unconditional. A header naming no version of this row gets -1, which never
+# matches.
+def expected_version(kind: str, id: int):
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    prefix = f'{kind}{id}.'
+    for tag in if_match:
+        if tag.startswith(prefix) and tag[len(prefix):].isdigit():
+            return int(tag[len(prefix):])
+    return -1
+
+def precondition_failed():
+    return jsonify({"Error": ERROR_PRECONDITION_FAILED}), 412
+
+# Initiates connection to database. `prepare`, when given, runs on the new
+# engine before it is published in `db`, so a request that finds `db` set
+# never sees a schema still being set up, and a failed preparation leaves
+# `db` unset to be retried.
+def init_db(prepare=None):
+    global db, router
+    engine = init_connection_pool()
+    if prepare is not None:
+        try:
+            prepare(engine)
+        except Exception:
+            engine.dispose()
+            raise
+    replica_router = init_replica_router(engine)
+    metrics.instrument_engine(engine)
+    profiling.instrument_engine(engine)
+    pool_capacity = metrics.pool_capacity(engine.pool) if isinstance(engine.pool, sqlalchemy.pool.QueuePool) else None
+    admission_control.gate.configure(ADMISSION_CAPACITY or pool_capacity or DEFAULT_ADMISSION_CAPACITY)
+    for replica in (replica_router.replicas if replica_router else []):
+        metrics.instrument_engine(replica, report_pool=False)
+        profiling.instrument_engine(replica)
+    router = replica_router
+    db = engine
+
+# Creates the tables and applies the migrations, unless one query shows the
+# schema is already at the latest version
+def prepare_schema(db: sqlalchemy.engine.base.Engine) -> None:
+    if schema_is_current(db):
+        return
+    create_table(db)
+    create_reviews_table(db)
+    create_business_stats_table(db)
+    migrate(db)
+
+# Cold start timings of this worker in seconds, exported at /metrics
+startup_seconds = {'import': None, 'init': None, 'first_request': None}
+init_lock = threading.Lock()
+
+# Sets up the engine and schema once per worker, on the first request or the
+# warmup request, whichever comes first. gunicorn imports the app without
+# running the __main__ block.
+def ensure_db() -> None:
+    if db is not None:
+        return
+    with init_lock:
+        if db is not None:
+            return
+        started = time.perf_counter()
+        init_db(prepare=prepare_schema)
+        startup_seconds['init'] = time.perf_counter() - started
+        logger.info('Database ready in %.3f s', startup_seconds['init'])
+
+first_request_seen = False
+
+@app.before_request
+def before_request_startup():
+    global first_request_seen
+    if not first_request_seen:
+        first_request_seen = True
+        g.first_request_started = time.perf_counter()
+    ensure_db()
+
+@app.teardown_request
+def teardown_request_startup(error=None):
+    started = g.pop('first_request_started', None)
+    if started is not None:
+        startup_seconds['first_request'] = time.perf_counter() - started
+        logger.info('First request served in %.3f s', startup_seconds['first_request'])
+
+# Requests a worker lets through to the database at once. By default this is
+# the number of connections its pool can hand out. See admission.py.
+ADMISSION_CAPACITY = int(os.environ.get('ADMISSION_CAPACITY', 0))
+# For pools without a fixed size
+DEFAULT_ADMISSION_CAPACITY = 7
+
+# Concurrent identical reads of these endpoints share one execution of the
+# view. Coalesced requests are answered before admission, so they take no slot.
+request_flights = singleflight.SingleFlight(
+    ['get_business', 'get_businesses', 'get_review', 'get_business_stats'],
+    bypass=reads_own_writes,
+)
+singleflight.instrument_app(app, request_flights)
+
+# Routes that never wait for a database connection skip admission, and the
+# batch endpoints are admitted behind reads and single writes
+admission_control = admission.from_environ(
+    ADMISSION_CAPACITY or DEFAULT_ADMISSION_CAPACITY,
+    exempt=['index', 'static', 'get_metrics', 'warmup', 'profiling_settings', 'profiling_stacks']
+           + (['create_review'] if REVIEW_INGEST_WORKERS > 0 else []),
+    bulk=['create_businesses_batch', 'create_reviews_batch'],
+)
+admission.instrument_app(app, admission_control)
+
+# A request that still times out waiting for a pool connection is answered
+# like one the admission control turned away
+@app.errorhandler(sqlalchemy.exc.TimeoutError)
+def pool_timeout(error):
+    logger.warning('Timed out waiting for a database connection: %s', error)
+    return admission.retry_after(jsonify({"Error": "The server is busy. Try again shortly"}), 1), 503
+
+# Connections the warmup request opens ahead of traffic
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', 2))
+
+# App Engine sends this before routing traffic to a new instance. Holding
+# several connections at once makes the pool open that many.
+@app.route('/_ah/warmup')
+def warmup():
+    with contextlib.ExitStack() as stack:
+        for _ in range(WARMUP_CONNECTIONS):
+            conn = stack.enter_context(db.connect())
+            conn.execute(sqlalchemy.text('SELECT 1'))
+    return '', 200
 
 # create 'businesses' table in database if it does not already exist
 def create_table(db: sqlalchemy.engine.base.Engine) -> None:
     with db.connect() as conn:
         conn.execute(
             sqlalchemy.text(
-                '''
+                f'''
                 CREATE TABLE IF NOT EXISTS businesses (
-                    business_id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+                    business_id {AUTO_ID_COLUMN[db.dialect.name]},
                     owner_id INT NOT NULL,
                     name VARCHAR(50) NOT NULL,
                     street_address VARCHAR(100) NOT NULL,
@@ -57,6 +438,43 @@ def create_table(db: sqlalchemy.engine.base.Engine) -> None:
 def index():
     return 'Please navigate to /businesses to use this API'
 
+# Prometheus metrics of this worker process
+@app.route('/metrics')
+def get_metrics():
+    return metrics.registry.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+# Admin endpoints are served only when ADMIN_TOKEN is set, to callers that
+# send it as a bearer token
+def admin_authorized() -> bool:
+    token = os.environ.get('ADMIN_TOKEN')
+    supplied = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(supplied, f'Bearer {token}')
+
+# Read or change the profiling settings at runtime
+@app.route('/admin/profiling', methods=['GET', 'PUT'])
+def profiling_settings():
+    if not admin_authorized():
+        return jsonify({"Error": "Not authorized"}), 403
+    if request.method == 'PUT':
+        content = request.get_json(silent=True)
+        if not isinstance(content, dict):
+            return jsonify({"Error": "The request body must be a JSON object"}), 400
+        try:
+            profiling.settings.update(content)
+        except (TypeError, ValueError) as e:
+            return jsonify({"Error": str(e)}), 400
+    return jsonify(profiling.settings.as_dict()), 200
+
+# The stacks sampled so far, in folded format. DELETE discards them.
+@app.route('/admin/profiling/stacks', methods=['GET', 'DELETE'])
+def profiling_stacks():
+    if not admin_authorized():
+        return jsonify({"Error": "Not authorized"}), 403
+    if request.method == 'DELETE':
+        profiling.sampler.reset()
+        return ('', 204)
+    return profiling.sampler.folded(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 # Create a new business 
 @app.route('/businesses', methods=['POST'])
 def create_business():
@@ -69,107 +487,393 @@ def create_business():
     # Connect to the database and insert the new business
     try:
         with db.connect() as conn:
-            stmt = sqlalchemy.text(
-                'INSERT INTO businesses(owner_id, name, street_address, city, state, zip_code) '
-                'VALUES (:owner_id, :name, :street_address, :city, :state, :zip_code)'
-            )
-            conn.execute(stmt, parameters={'owner_id': content['owner_id'], 
+            result = conn.execute(INSERT_BUSINESS_STMT, parameters={'owner_id': content['owner_id'], 
                                         'name': content['name'], 
                                         'street_address': content['street_address'],
                                         'city': content['city'],
                                         'state': content['state'],
                                         'zip_code': content['zip_code']})
+            # The driver reports the new ID with the INSERT's own response
+            business_id = result.lastrowid
+            conn.execute(INSERT_BUSINESS_STATS_STMT, {'business_id': business_id})
             conn.commit()
+            business_search.update(business_id, content['name'])
 
-            # Get the ID of the new business
-            business_id = conn.execute(text('SELECT LAST_INSERT_ID()')).scalar()
-
-            business_url = f'{request.url_root}businesses/{business_id}'
-            return ({'id': business_id,
-                            'owner_id': content['owner_id'],
-                            'name': content['name'],
-                            'street_address': content['street_address'],
-                            'city': content['city'],
-                            'state': content['state'],
-                            'zip_code': content['zip_code'], 
-                            'self': business_url}), 201
+            business = Business(business_id, *(content[field] for field in BUSINESS_FIELDS))
+            response = json_response(business.to_dict(request.url_root))
+            response.set_etag(row_etag('b', business_id, 1))
+            return response, 201
     except Exception as e:
         logger.exception(e)
         return ('Error:', 'Unable to create business'), 500
-    
+
+INSERT_BUSINESS_STMT = statements.registry.add(
+    'insert_business',
+    'INSERT INTO businesses(owner_id, name, street_address, city, state, zip_code) '
+    'VALUES (:owner_id, :name, :street_address, :city, :state, :zip_code)'
+)
+# Each business starts with an empty stats row, which the rating sort relies on
+INSERT_BUSINESS_STATS_STMT = statements.registry.add(
+    'insert_business_stats', 'INSERT INTO business_stats (business_id) VALUES (:business_id)'
+)
+
+# Create many businesses in one request. Every item is validated up front, then
+# the valid ones are inserted with executemany in chunked transactions. The
+# response holds one result per item, in request order.
+@app.route('/businesses:batch', methods=['POST'])
+def create_businesses_batch():
+    content = request.get_json()
+    error = check_batch_body(content)
+    if error:
+        return error
+
+    results = [None] * len(content)
+    valid = []
+    for index, item in enumerate(content):
+        error = business_item_error(item)
+        if error:
+            results[index] = error
+        else:
+            valid.append(index)
+
+    url_root = request.url_root
+    with db.connect() as conn:
+        for chunk in chunked(valid, BATCH_CHUNK_SIZE):
+            rows = [{field: content[index][field] for field in BUSINESS_FIELDS} for index in chunk]
+            try:
+                business_ids = insert_rows(conn, INSERT_BUSINESS_STMT, rows)
+                conn.execute(INSERT_BUSINESS_STATS_STMT, [{'business_id': business_id} for business_id in business_ids])
+                conn.commit()
+            except Exception as e:
+                logger.exception(e)
+                conn.rollback()
+                for index in chunk:
+                    results[index] = {'status': 500, 'Error': 'Unable to create business'}
+                continue
+            for index, business_id in zip(chunk, business_ids):
+                business_search.update(business_id, content[index]['name'])
+                results[index] = {'status': 201,
+                                  'id': business_id,
+                                  'self': f'{url_root}businesses/{business_id}'}
+
+    return jsonify({'results': results}), 200
+
+# Checks one business of a batch against the column types, returning its
+# result entry if it is invalid. A value the database would reject must not
+# reach the INSERT, where it fails every other item of its chunk.
+def business_item_error(item):
+    if not isinstance(item, dict) or not all(field in item for field in BUSINESS_FIELDS):
+        return {'status': 400, 'Error': ERROR_MISSING_ATTRIBUTES}
+    for field in BUSINESS_FIELDS:
+        value = item[field]
+        if field in BUSINESS_FIELD_LENGTHS:
+            if not isinstance(value, str) or len(value) > BUSINESS_FIELD_LENGTHS[field]:
+                return {'status': 400,
+                        'Error': f"{field} must be a string of at most {BUSINESS_FIELD_LENGTHS[field]} characters"}
+        elif not valid_int(value):
+            return {'status': 400, 'Error': f"{field} must be an integer"}
+    return None
+
+# Filters on GET /businesses: the condition each adds and how its value is
+# parsed. city and state are served by idx_businesses_state_city, zip_code
+# and owner_id by their own indexes, and min_stars by idx_business_stats_rating.
+# A business without reviews has a rating of 0, so min_stars also asks for
+# at least one review.
+BUSINESS_FILTERS = {
+    'city': ('b.city = :city', str),
+    'state': ('b.state = :state', str),
+    'zip_code': ('b.zip_code = :zip_code', int),
+    'owner_id': ('b.owner_id = :owner_id', int),
+    'min_stars': ('s.rating >= :min_stars AND s.review_count > 0', float),
+}
+# The sorts of GET /businesses and the keys their cursors hold. `rating` is
+# best first, by the precomputed business_stats.rating, and reads
+# idx_business_stats_rating backwards, so ties come newest first.
+BUSINESS_SORTS = {
+    'id': ('business_id',),
+    'rating': ('rating', 'business_id'),
+}
+BUSINESS_ORDER = {
+    'id': 'ORDER BY b.business_id',
+    'rating': 'ORDER BY s.rating DESC, s.business_id DESC',
+}
+# Parameters the next page link repeats besides the filters and sort
+BUSINESS_LIST_PASSED = ('fields', 'include')
+
+# Builds the WHERE, ORDER BY and LIMIT clauses of a GET /businesses page from
+# its query parameters. Clients that pass `offset` keep the original
+# LIMIT/OFFSET paging. Everyone else pages by keyset: `cursor` is an opaque
+# token holding the sort key of the last business seen, so every page resumes
+# with an index range scan no matter how deep into the results it is. Raises
+# ValueError, with the message for the response, on an invalid parameter.
+def business_list_page(args) -> tuple:
+    sort = args.get('sort', 'id')
+    if sort not in BUSINESS_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(BUSINESS_SORTS)}")
+    try:
+        limit = int(args.get('limit', 3))
+        filters = {name: convert(args[name]) for name, (_, convert) in BUSINESS_FILTERS.items() if name in args}
+        if 'offset' in args:
+            offset = int(args['offset'])
+            after = None
+        else:
+            offset = None
+            cursor = args.get('cursor')
+            after = decode_cursor(cursor, len(BUSINESS_SORTS[sort])) if cursor else None
+    except ValueError:
+        raise ValueError('Invalid query parameter')
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    if offset is not None and offset < 0:
+        raise ValueError('offset must not be negative')
+
+    conditions = [BUSINESS_FILTERS[name][0] for name in filters]
+    params = dict(filters, limit=limit)
+    if after is not None:
+        if sort == 'rating':
+            # The first condition bounds the index range, the second skips
+            # the ties already seen
+            conditions.append('s.rating <= :rating AND (s.rating < :rating OR s.business_id < :last_id)')
+            params.update(rating=float(after[0]), last_id=int(after[1]))
+        else:
+            conditions.append('b.business_id > :last_id')
+            params['last_id'] = int(after[0])
+    page = ('WHERE ' + ' AND '.join(conditions) + ' ' if conditions else '') + BUSINESS_ORDER[sort] + ' LIMIT :limit'
+    if offset is not None:
+        page += ' OFFSET :offset'
+        params['offset'] = offset
+    return page, params, sort, filters, limit, offset
+
+# The FROM clause of a GET /businesses page. A rating sort or filter joins
+# business_stats with an inner join, so the sort can be driven from its
+# rating index; a business missing its stats row has no rating to match.
+# include=stats alone keeps every business, with empty stats if it has no row.
+def business_list_source(with_stats: bool, sort: str, filters: dict) -> str:
+    if sort == 'rating' or 'min_stars' in filters:
+        return 'businesses b JOIN business_stats s ON s.business_id = b.business_id'
+    if with_stats:
+        return 'businesses b LEFT JOIN business_stats s ON s.business_id = b.business_id'
+    return 'businesses b'
+
+# Returns the URL of the next GET /businesses page, which repeats the filters
+# and sort, or None after the last page. A `rating` page selects the rating
+# as its last column.
+def business_list_next(url_root: str, args, sort: str, filters: dict, limit: int, offset, rows: list):
+    if not rows or len(rows) < limit:
+        return None
+    query = {name: args[name] for name in (*filters, *BUSINESS_LIST_PASSED) if name in args}
+    if sort != 'id':
+        query['sort'] = sort
+    query['limit'] = limit
+    if offset is not None:
+        query['offset'] = offset + limit
+    elif sort == 'rating':
+        query['cursor'] = encode_cursor(rows[-1][-1], rows[-1][0])
+    else:
+        query['cursor'] = encode_cursor(rows[-1][0])
+    return f"{url_root}businesses?{urllib.parse.urlencode(query)}"
+
 #Return all businesses
 @app.route('/businesses', methods=['GET'])
 def get_businesses():
-    # Set offsets and limits for pagination
+    if 'ids' in request.args:
+        return get_businesses_by_id()
     try:
-        offset = int(request.args.get('offset', 0))
-        limit = int(request.args.get('limit', 3)) 
+        page, params, sort, filters, limit, offset = business_list_page(request.args)
+        # The version is read for the page's ETag
+        fieldset = FieldSet.parse(Business, request.args.get('fields'), extra=('version',))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+
+    # Stats move with every review write without touching the business rows,
+    # so pages that include, filter or sort by them carry no ETag
+    with_stats = include_stats()
+    rated = sort == 'rating' or 'min_stars' in filters
+    versioned = not (with_stats or rated)
+    engine = read_db()
+    columns = fieldset.columns('b')
+    source = business_list_source(with_stats, sort, filters)
+    if with_stats:
+        columns += f', {STATS_COLUMNS}'
+    if sort == 'rating':
+        columns += ', s.rating'
+
+    with engine.connect() as conn:
+        # A revalidation reads only the ids and versions of the page, an index
+        # scan, and skips building the body when they are unchanged
+        if request.if_none_match and versioned:
+            versions = conn.execute(
+                statements.statement(f'SELECT b.business_id, b.version FROM {source} {page}'), params
+            ).all()
+            etag = page_etag(versions)
+            if client_has(etag):
+                return not_modified(etag, weak=True)
+        results = conn.execute(statements.statement(f'SELECT {columns} FROM {source} {page}'), params).all()
+
+    url_root = request.url_root
+    models = [fieldset.from_row(row) for row in results]
+    businesses = [fieldset.to_dict(business, url_root) for business in models]
+    if with_stats:
+        # The stats columns follow the business columns
+        stats_start = len(fieldset.column_names)
+        for business_dict, row in zip(businesses, results):
+            business_dict['stats'] = stats_dict(row[stats_start:stats_start + len(STATS_FIELDS)])
+
+    next_url = business_list_next(url_root, request.args, sort, filters, limit, offset, results)
+    response = json_response({
+        'entries': businesses,
+        'next': next_url
+    })
+    if versioned:
+        response.set_etag(page_etag((business.id, business.version) for business in models), weak=True)
+    return response, 200
+
+# GET /businesses?ids=1,2,3 returns the named businesses, in the order named,
+# and lists the ids that do not exist under `missing`. Paging, filters and
+# sort do not apply.
+def get_businesses_by_id():
+    try:
+        ids = parse_ids(request.args['ids'])
+        fieldset = FieldSet.parse(Business, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    with_stats = include_stats()
+    engine = read_db()
+    found = load_businesses(engine, ids)
+    ordered = [found[business_id] for business_id in ids if business_id in found]
+    etag = page_etag((business.id, business.version) for business in ordered)
+    if not with_stats and client_has(etag):
+        return not_modified(etag, weak=True)
+
+    url_root = request.url_root
+    businesses = [fieldset.to_dict(business, url_root) for business in ordered]
+    if with_stats:
+        stats = load_stats(engine, list(found))
+        for business, business_dict in zip(ordered, businesses):
+            business_dict['stats'] = stats_dict(stats.get(business.id, [None] * len(STATS_FIELDS)))
+    response = json_response({
+        'entries': businesses,
+        'missing': [business_id for business_id in ids if business_id not in found]
+    })
+    if not with_stats:
+        response.set_etag(etag, weak=True)
+    return response, 200
+
+# Parses a comma separated list of ids, dropping repeats, and raises
+# ValueError if it is empty, malformed or longer than MULTI_GET_MAX_IDS
+def parse_ids(value: str) -> list:
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',')))
     except ValueError:
-        return jsonify({"Error": "Invalid query parameter"}), 400
+        raise ValueError('ids must be a comma separated list of integers')
+    if len(ids) > MULTI_GET_MAX_IDS:
+        raise ValueError(f'ids may name at most {MULTI_GET_MAX_IDS} businesses')
+    return ids
 
-    with db.connect() as conn:
-        # Query to fetch businesses with pagination/offset
-        query = sqlalchemy.text(
-            'SELECT business_id, owner_id, name, street_address, city, state, zip_code '
-            'FROM businesses ORDER BY business_id LIMIT :limit OFFSET :offset'
-        )
-        results = conn.execute(query, {'limit': limit, 'offset': offset}).mappings().all()
-        businesses = []
-
-        for business in results:
-            business_dict = {
-                'id': business['business_id'],  # Changed 'business_id' to 'id'
-                'owner_id': business['owner_id'],
-                'name': business['name'],
-                'street_address': business['street_address'],
-                'city': business['city'],
-                'state': business['state'],
-                'zip_code': business['zip_code'],
-                'self': f"{request.url_root}businesses/{business['business_id']}"
-            }
-            businesses.append(business_dict)
-
-        # Determine if there is a next page
-        if len(businesses) == limit:
-            next_offset = offset + limit
-            next_url = f"{request.url_root}businesses?limit={limit}&offset={next_offset}"
+# Returns the related resources named by the comma separated `expand`
+# parameter, raising ValueError for one this endpoint cannot embed
+def requested_expansions(args, allowed: tuple) -> set:
+    expand = {name.strip() for name in args.get('expand', '').split(',') if name.strip()}
+    unknown = expand.difference(allowed)
+    if unknown:
+        raise ValueError(f"expand may only name {', '.join(allowed)}")
+    return expand
+
+# Loads businesses by id, from the row cache where possible and with one
+# IN query for the rest. Ids without a business are left out.
+def load_businesses(engine: sqlalchemy.engine.base.Engine, ids) -> dict:
+    found = {}
+    missing = []
+    for business_id in ids:
+        entry = cached_row(business_key(business_id))
+        if entry is None:
+            missing.append(business_id)
         else:
-            next_url = None
+            found[business_id] = Business(**entry)
+    if missing:
+        with engine.connect() as conn:
+            rows = conn.execute(LOAD_BUSINESSES_STMT, {'ids': missing}).all()
+        for row in rows:
+            business = Business.from_row(row)
+            cache_row(engine, business_key(business.id), business.fields())
+            found[business.id] = business
+    return found
 
-        response = {
-            'entries': businesses,
-            'next': next_url
-        }
+LOAD_BUSINESSES_STMT = statements.registry.add(
+    'load_businesses', f'SELECT {Business.columns()} FROM businesses WHERE business_id IN :ids', expanding=('ids',)
+)
 
-        return jsonify(response), 200
+# Reads the stats columns of several businesses with one IN query. Businesses
+# without reviews have no row.
+def load_stats(engine: sqlalchemy.engine.base.Engine, ids: list) -> dict:
+    if not ids:
+        return {}
+    with engine.connect() as conn:
+        rows = conn.execute(LOAD_STATS_STMT, {'ids': ids}).all()
+    return {row[0]: row[1:] for row in rows}
 
 # Return a single business 
 @app.route('/businesses/<int:id>', methods=['GET'])
 def get_business(id):
-    with db.connect() as conn:
-        stmnt = sqlalchemy.text(
-            '''
-            SELECT business_id, owner_id, name, street_address, city, state, zip_code
-            FROM businesses WHERE business_id = :business_id
-            '''
-        )
-        result = conn.execute(stmnt, {'business_id': id}).mappings().one_or_none()
+    try:
+        expand = requested_expansions(request.args, ('reviews',))
+        reviews_limit = int(request.args.get('reviews_limit', EXPAND_REVIEWS_LIMIT))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    if not 1 <= reviews_limit <= EXPAND_REVIEWS_MAX_LIMIT:
+        return jsonify({"Error": f"reviews_limit must be from 1 to {EXPAND_REVIEWS_MAX_LIMIT}"}), 400
+    with_stats = include_stats()
+    # Stats and reviews change without a new version of the business, so
+    # responses that include them carry no ETag
+    versioned = not (with_stats or expand)
+    engine = read_db()
+    business = cached_row(business_key(id))
+    # On a cache miss a revalidation reads only the version
+    if business is None and request.if_none_match and versioned:
+        with engine.connect() as conn:
+            version = conn.execute(GET_BUSINESS_VERSION_STMT, {'business_id': id}).scalar()
+        if version is not None and client_has(row_etag('b', id, version)):
+            return not_modified(row_etag('b', id, version))
+    if business is None:
+        with engine.connect() as conn:
+            result = conn.execute(GET_BUSINESS_STMT, {'business_id': id}).one_or_none()
 
         if result is None:
             return jsonify({"Error": "No business with this business_id exists"}), 404
-        else:
-            # Construct the response dictionary explicitly in the desired order
-            business = {
-                'id': result['business_id'],
-                'owner_id': result['owner_id'],
-                'name': result['name'],
-                'street_address': result['street_address'],
-                'city': result['city'],
-                'state': result['state'],
-                'zip_code': result['zip_code'],
-                'self': f"http://{request.host}/businesses/{result['business_id']}"
-            }
-            return jsonify(business), 200
+        business = Business.from_row(result)
+        cache_row(engine, business_key(id), business.fields())
+    else:
+        business = Business(**business)
+
+    etag = row_etag('b', id, business.version)
+    if versioned and client_has(etag):
+        return not_modified(etag)
+    url_root = request.url_root
+    business_dict = business.to_dict(url_root)
+    # Stats change with every review write, so they are read fresh by primary key
+    if with_stats:
+        with engine.connect() as conn:
+            stats = conn.execute(GET_STATS_STMT, {'business_id': id}).one_or_none()
+        business_dict['stats'] = stats_dict(stats or [None] * len(STATS_FIELDS))
+    if 'reviews' in expand:
+        with engine.connect() as conn:
+            rows = conn.execute(GET_BUSINESS_REVIEWS_STMT, {'business_id': id, 'limit': reviews_limit}).all()
+        business_dict['reviews'] = [Review.from_row(row).to_dict(url_root) for row in rows]
+    response = json_response(business_dict)
+    if versioned:
+        response.set_etag(etag)
+    return response, 200
+
+GET_BUSINESS_VERSION_STMT = statements.registry.add(
+    'get_business_version', 'SELECT version FROM businesses WHERE business_id = :business_id'
+)
+GET_BUSINESS_STMT = statements.registry.add(
+    'get_business', f'SELECT {Business.columns()} FROM businesses WHERE business_id = :business_id'
+)
+GET_BUSINESS_REVIEWS_STMT = statements.registry.add(
+    'get_business_reviews',
+    f'SELECT {Review.columns()} FROM reviews WHERE business_id = :business_id ORDER BY review_id LIMIT :limit'
+)
 
 # Edit a business
 @app.route('/businesses' + '/<int:id>', methods=['PUT'])
@@ -179,89 +883,102 @@ def edit_business(id):
     # Error handle if we are missing any fields
     if not all(field in content for field in required_fields):
         return jsonify({"Error": "The request body is missing at least one of the required attributes"}), 400
-            
+    # With If-Match the UPDATE only matches the version the client last saw
+    expected = expected_version('b', id)
+
     with db.connect() as conn:
-        # Check if the business exists
-        check_stmnt = sqlalchemy.text(
-            'SELECT * FROM businesses WHERE business_id=:business_id'
-        )
-        
-        result = conn.execute(check_stmnt, parameters={'business_id': id}).fetchone()
-        if not result:
-            return ERORR_NOT_FOUND, 404
         # Update the business
-        update_stmnt = sqlalchemy.text(
-                'UPDATE businesses '
-                'SET owner_id = :owner_id, name = :name, street_address = :street_address, city = :city, state = :state, zip_code = :zip_code '
-                'WHERE business_id = :business_id'
-            )
-        conn.execute(update_stmnt, parameters={'owner_id': content['owner_id'],
+        update_stmnt = EDIT_BUSINESS_STMT if expected is None else EDIT_BUSINESS_VERSION_STMT
+        result = conn.execute(update_stmnt, parameters={'owner_id': content['owner_id'],
                                             'name': content['name'],
                                             'street_address': content['street_address'],
                                             'city': content['city'],
                                             'state': content['state'],
                                             'zip_code': content['zip_code'],
-                                            'business_id': id})
+                                            'business_id': id,
+                                            'version': expected})
+        # Check if the business exists from the number of rows the UPDATE matched
+        if result.rowcount == 0:
+            conn.rollback()
+            if expected is not None and conn.execute(BUSINESS_EXISTS_STMT, {'business_id': id}).first():
+                return precondition_failed()
+            return ERORR_NOT_FOUND, 404
         conn.commit()
+        cache.invalidate(business_key(id))
+        business_search.update(id, content['name'])
         # Return updated business
-        business_url = f'{request.url_root}businesses/{id}'
-        updated_business = {
-            'id': id,
-            'owner_id': content['owner_id'],
-            'name': content['name'],
-            'street_address': content['street_address'],
-            'city': content['city'],
-            'state': content['state'],
-            'zip_code': content['zip_code'],
-            'self': business_url
-        }
-        return jsonify(updated_business), 200
+        updated_business = Business(id, *(content[field] for field in BUSINESS_FIELDS))
+        response = json_response(updated_business.to_dict(request.url_root))
+        # The new version is only known when the UPDATE was conditional
+        if expected is not None:
+            response.set_etag(row_etag('b', id, expected + 1))
+        return response, 200
+
+EDIT_BUSINESS_SQL = (
+    'UPDATE businesses '
+    'SET owner_id = :owner_id, name = :name, street_address = :street_address, city = :city, state = :state, zip_code = :zip_code, '
+    'version = version + 1 '
+    'WHERE business_id = :business_id'
+)
+EDIT_BUSINESS_STMT = statements.registry.add('edit_business', EDIT_BUSINESS_SQL)
+EDIT_BUSINESS_VERSION_STMT = statements.registry.add('edit_business_version', EDIT_BUSINESS_SQL + ' AND version = :version')
+BUSINESS_EXISTS_STMT = statements.registry.add(
+    'business_exists', 'SELECT 1 FROM businesses WHERE business_id = :business_id'
+)
 
 # Delete a business
 @app.route('/businesses' + '/<int:id>', methods=['DELETE'])
 def delete_business(id):
     with db.connect() as conn:
-        stmnt = sqlalchemy.text(
-            'DELETE FROM businesses WHERE business_id=:business_id'
-        )
+        # The FK cascade removes the business's reviews, so note their ids to
+        # drop them from the cache as well
+        review_ids = conn.execute(
+            BUSINESS_REVIEW_IDS_STMT, parameters={'business_id': id}
+        ).scalars().all()
         # Check if the business exists
-        result = conn.execute(stmnt, parameters={'business_id': id})
+        result = conn.execute(DELETE_BUSINESS_STMT, parameters={'business_id': id})
         conn.commit()
         if result.rowcount == 1:
+            cache.invalidate(business_key(id), *(review_key(review_id) for review_id in review_ids))
+            business_search.remove(id)
+            review_search.remove(*review_ids)
             return ('', 204)
         else:
             return ERORR_NOT_FOUND, 404
-    
-        
+
+BUSINESS_REVIEW_IDS_STMT = statements.registry.add(
+    'business_review_ids', 'SELECT review_id FROM reviews WHERE business_id=:business_id'
+)
+DELETE_BUSINESS_STMT = statements.registry.add(
+    'delete_business', 'DELETE FROM businesses WHERE business_id=:business_id'
+)
+
 # List all Bussiness for an owner
 @app.route('/owners' + '/<int:owner_id>' + '/businesses', methods=['GET'])
 def get_owners_businesses(owner_id):
-    with db.connect() as conn:
-        # Select all businesses for the specified owner
-        query = sqlalchemy.text(
-            "SELECT business_id, owner_id, name, street_address, city, state, zip_code "
-            "FROM businesses WHERE owner_id = :owner_id"
-        )
-        results = conn.execute(query, {'owner_id': owner_id}).mappings().all()
-
-        if not results:
-            return jsonify({"Error": "No businesses found for this owner_id"}), 404
-        # Construct dictionary of businesses
-        businesses = []
-        for business in results:
-            business_dict = {
-                'id': business['business_id'],  # Changed 'business_id' to 'id'
-                'owner_id': business['owner_id'],
-                'name': business['name'],
-                'street_address': business['street_address'],
-                'city': business['city'],
-                'state': business['state'],
-                'zip_code': business['zip_code'],
-                'self': f"{request.url_root}businesses/{business['business_id']}"
-            }
-            businesses.append(business_dict)
-
-        return jsonify(businesses), 200
+    try:
+        fieldset = FieldSet.parse(Business, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    # Select all businesses for the specified owner
+    query = statements.statement(
+        f"SELECT {fieldset.columns()} FROM businesses WHERE owner_id = :owner_id"
+    )
+    not_found = {"Error": "No businesses found for this owner_id"}
+    engine = read_db()
+    encoding = requested_encoding()
+    if encoding:
+        return stream_query(engine, query, {'owner_id': owner_id}, fieldset.row_dict, not_found,
+                            encoding, STREAM_BATCH_SIZE)
+
+    with engine.connect() as conn:
+        results = conn.execute(query, {'owner_id': owner_id}).all()
+
+    if not results:
+        return jsonify(not_found), 404
+    # Construct dictionary of businesses
+    url_root = request.url_root
+    return json_response([fieldset.row_dict(row, url_root) for row in results]), 200
 
 ###########################################################################
 #                                                                         #
@@ -275,9 +992,9 @@ def create_reviews_table(db: sqlalchemy.engine.base.Engine) -> None:
         with db.connect() as conn:
             conn.execute(
                 sqlalchemy.text(
-                    '''
+                    f'''
                     CREATE TABLE IF NOT EXISTS reviews (
-                        review_id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+                        review_id {AUTO_ID_COLUMN[db.dialect.name]},
                         business_id BIGINT UNSIGNED NOT NULL,
                         user_id INT NOT NULL,
                         stars INT NOT NULL,
@@ -299,96 +1016,306 @@ def create_review():
     required_fields = ['user_id', 'business_id', 'stars']
     if not all(field in content for field in required_fields):
         return jsonify({"Error": "The request body is missing at least one of the required attributes"}), 400
+    if not valid_stars(content['stars']):
+        return jsonify({"Error": ERROR_INVALID_STARS}), 400
+    if not valid_review_text(content.get('review_text', '')):
+        return jsonify({"Error": ERROR_INVALID_REVIEW_TEXT}), 400
+    if review_ingest is not None:
+        return enqueue_review(content)
 
     with db.connect() as conn:
         try:
-            # Check if the specified business exists
-            business_exists = conn.execute(
-                sqlalchemy.text("SELECT 1 FROM businesses WHERE business_id = :business_id"),
-                {'business_id': content['business_id']}
-            ).scalar()
-
-            if not business_exists:
-                return jsonify({"Error": "No business with this business_id exists"}), 404
-
-            # Check for an existing review by the same user for the same business
-            review_exists = conn.execute(
-                sqlalchemy.text("SELECT 1 FROM reviews WHERE user_id = :user_id AND business_id = :business_id"),
-                {'user_id': content['user_id'], 'business_id': content['business_id']}
-            ).scalar()
-
-            if review_exists:
-                return jsonify({"Error": "You have already submitted a review for this business. You can update your previous review, or delete it and submit a new review"}), 409
-
-            # Insert the new review
+            # Insert the new review. The foreign key rejects a business that does
+            # not exist, and the unique (business_id, user_id) index a second
+            # review by the same user for the same business.
             review_text = content.get('review_text', '')
-            conn.execute(
-                sqlalchemy.text(
-                    "INSERT INTO reviews (user_id, business_id, stars, review_text) VALUES (:user_id, :business_id, :stars, :review_text)"
-                ),
-                {'user_id': content['user_id'], 'business_id': content['business_id'], 'stars': content['stars'], 'review_text': review_text}
-            )
-            review_id = conn.execute(sqlalchemy.text("SELECT LAST_INSERT_ID()")).scalar()
+            try:
+                result = conn.execute(
+                    INSERT_REVIEWS_STMT,
+                    {'user_id': content['user_id'], 'business_id': content['business_id'], 'stars': content['stars'], 'review_text': review_text}
+                )
+            except sqlalchemy.exc.IntegrityError as e:
+                conn.rollback()
+                if is_duplicate_key(e):
+                    return jsonify({"Error": ERROR_DUPLICATE_REVIEW}), 409
+                if is_missing_reference(e):
+                    return jsonify({"Error": "No business with this business_id exists"}), 404
+                raise
+            review_id = result.lastrowid
+            apply_stats_deltas(conn, [stats_delta(content['business_id'], added=[content['stars']])])
             conn.commit()
+            review_search.update(review_id, review_text)
 
             # return the new review
-            review_url = f"{request.url_root}reviews/{review_id}"
-            business_url = f"{request.url_root}businesses/{content['business_id']}"
-            return jsonify({
-                'id': review_id,
-                'user_id': content['user_id'],
-                'business': business_url,
-                'stars': content['stars'],
-                'review_text': review_text,
-                'self': review_url
-            }), 201
+            review = Review(review_id, content['user_id'], content['business_id'], content['stars'], review_text)
+            response = json_response(review.to_dict(request.url_root))
+            response.set_etag(row_etag('r', review_id, 1))
+            return response, 201
 
         except Exception as e:
             logger.exception("Failed to create review: %s", e)
             conn.rollback()
             return jsonify({'Error': 'Unable to create review', 'Exception': str(e)}), 500
 
+# Create many reviews in one request. Business existence and duplicate
+# (user_id, business_id) reviews are checked with one set-based query per
+# chunk rather than two SELECTs per review.
+@app.route('/reviews:batch', methods=['POST'])
+def create_reviews_batch():
+    content = request.get_json()
+    error = check_batch_body(content)
+    if error:
+        return error
+
+    results = [None] * len(content)
+    valid = []
+    for index, item in enumerate(content):
+        error = review_item_error(item)
+        if error:
+            results[index] = error
+        else:
+            valid.append(index)
+
+    url_root = request.url_root
+    with db.connect() as conn:
+        for chunk in chunked(valid, BATCH_CHUNK_SIZE):
+            try:
+                chunk_results = insert_reviews(conn, [content[index] for index in chunk])
+            except Exception as e:
+                logger.exception("Failed to create reviews: %s", e)
+                conn.rollback()
+                chunk_results = [{'status': 500, 'Error': 'Unable to create review'}] * len(chunk)
+            for index, result in zip(chunk, chunk_results):
+                if result['status'] == 201:
+                    result['self'] = f"{url_root}reviews/{result['id']}"
+                results[index] = result
+
+    return jsonify({'results': results}), 200
+
+# Checks one review of a batch or queued submission, returning its result
+# entry if it is invalid
+def review_item_error(item):
+    if not isinstance(item, dict) or not all(field in item for field in REVIEW_FIELDS):
+        return {'status': 400, 'Error': ERROR_MISSING_ATTRIBUTES}
+    if not (valid_int(item['user_id']) and valid_int(item['business_id'], BIGINT_UNSIGNED_RANGE)):
+        return {'status': 400, 'Error': "user_id and business_id must be integers"}
+    if not valid_stars(item['stars']):
+        return {'status': 400, 'Error': ERROR_INVALID_STARS}
+    if not valid_review_text(item.get('review_text', '')):
+        return {'status': 400, 'Error': ERROR_INVALID_REVIEW_TEXT}
+    return None
+
+# review_text is optional and may be null, as its column is, and otherwise a
+# string that fits the column
+def valid_review_text(review_text) -> bool:
+    return review_text is None or (isinstance(review_text, str) and len(review_text) <= REVIEW_TEXT_MAX_LENGTH)
+
+# Writes validated reviews in one transaction and returns a result entry per
+# review. Business existence and duplicate (user_id, business_id) reviews are
+# checked with one set-based query each rather than two SELECTs per review.
+# Database errors are raised with the transaction still open.
+def insert_reviews(conn, items: list) -> list:
+    business_ids = {item['business_id'] for item in items}
+    user_ids = {item['user_id'] for item in items}
+    existing_businesses = set(conn.execute(
+        INSERT_REVIEWS_BUSINESS_STMT, {'business_ids': list(business_ids)}).scalars())
+    existing_reviews = set(conn.execute(
+        INSERT_REVIEWS_REVIEW_STMT, {'business_ids': list(business_ids), 'user_ids': list(user_ids)}).tuples())
+
+    results = [None] * len(items)
+    to_insert = []
+    for index, item in enumerate(items):
+        pair = (item['user_id'], item['business_id'])
+        if item['business_id'] not in existing_businesses:
+            results[index] = {'status': 404, 'Error': ERORR_NOT_FOUND['Error']}
+        elif pair in existing_reviews:
+            results[index] = {'status': 409, 'Error': ERROR_DUPLICATE_REVIEW}
+        else:
+            # A later review by the same user in the same batch is a duplicate
+            existing_reviews.add(pair)
+            to_insert.append(index)
+    if not to_insert:
+        conn.rollback()
+        return results
+
+    review_ids = insert_rows(conn, INSERT_REVIEWS_STMT, [{'user_id': items[index]['user_id'],
+                                                         'business_id': items[index]['business_id'],
+                                                         'stars': items[index]['stars'],
+                                                         'review_text': items[index].get('review_text', '')}
+                                                        for index in to_insert])
+    added = {}
+    for index in to_insert:
+        added.setdefault(items[index]['business_id'], []).append(items[index]['stars'])
+    apply_stats_deltas(conn, [stats_delta(business_id, added=stars)
+                              for business_id, stars in added.items()])
+    conn.commit()
+
+    for index, review_id in zip(to_insert, review_ids):
+        review_search.update(review_id, items[index].get('review_text', ''))
+        results[index] = {'status': 201, 'id': review_id}
+    return results
+
+INSERT_REVIEWS_BUSINESS_STMT = statements.registry.add(
+    'insert_reviews_businesses',
+    'SELECT business_id FROM businesses WHERE business_id IN :business_ids',
+    expanding=('business_ids',)
+)
+INSERT_REVIEWS_REVIEW_STMT = statements.registry.add(
+    'insert_reviews_reviews',
+    'SELECT user_id, business_id FROM reviews '
+    'WHERE business_id IN :business_ids AND user_id IN :user_ids',
+    expanding=('business_ids', 'user_ids')
+)
+INSERT_REVIEWS_STMT = statements.registry.add(
+    'insert_review',
+    'INSERT INTO reviews (user_id, business_id, stars, review_text) '
+    'VALUES (:user_id, :business_id, :stars, :review_text)'
+)
+
+# Writes one batch taken from the ingest queue
+def write_queued_reviews(items: list) -> list:
+    with db.connect() as conn:
+        try:
+            return insert_reviews(conn, items)
+        except Exception:
+            conn.rollback()
+            raise
+
+RECORD_INGEST_RESULT_STMT = statements.registry.add(
+    'record_ingest_result',
+    'INSERT INTO review_ingest_results (ticket, status, review_id, error, finished_at) '
+    'VALUES (:ticket, :status, :review_id, :error, :finished_at)'
+)
+PRUNE_INGEST_RESULTS_STMT = statements.registry.add(
+    'prune_ingest_results',
+    'DELETE FROM review_ingest_results WHERE finished_at < :before'
+)
+GET_INGEST_RESULT_STMT = statements.registry.add(
+    'get_ingest_result',
+    'SELECT status, review_id, error FROM review_ingest_results WHERE ticket = :ticket'
+)
+
+# Stores the results of one written batch for every worker to read, and
+# drops the results that have outlived REVIEW_INGEST_RESULT_SECONDS
+def record_ingest_results(entries: list) -> None:
+    finished_at = time.time()
+    with db.connect() as conn:
+        conn.execute(RECORD_INGEST_RESULT_STMT, [
+            {'ticket': ticket, 'status': result['status'], 'review_id': result.get('id'),
+             'error': result.get('Error'), 'finished_at': finished_at}
+            for ticket, result in entries
+        ])
+        conn.execute(PRUNE_INGEST_RESULTS_STMT, {'before': finished_at - REVIEW_INGEST_RESULT_SECONDS})
+        conn.commit()
+
+# The recorded result of a queued review, read from the primary since the
+# worker that wrote it may be another process
+def lookup_ingest_result(ticket: str):
+    with db.connect() as conn:
+        row = conn.execute(GET_INGEST_RESULT_STMT, {'ticket': ticket}).first()
+    if row is None:
+        return None
+    if row.status == 201:
+        return {'status': row.status, 'id': row.review_id}
+    return {'status': row.status, 'Error': row.error}
+
+review_ingest = ingest.IngestQueue(
+    write_queued_reviews,
+    capacity=REVIEW_INGEST_QUEUE_SIZE,
+    workers=REVIEW_INGEST_WORKERS,
+    batch_size=REVIEW_INGEST_BATCH_SIZE,
+    max_attempts=REVIEW_INGEST_MAX_ATTEMPTS,
+    retention=REVIEW_INGEST_STATUS_RETENTION,
+    drain_seconds=REVIEW_INGEST_DRAIN_SECONDS,
+    record=record_ingest_results,
+    lookup=lookup_ingest_result,
+    pending_seconds=REVIEW_INGEST_PENDING_SECONDS,
+) if REVIEW_INGEST_WORKERS > 0 else None
+
+if review_ingest is not None:
+    metrics.registry.add(metrics.Gauge('review_ingest_queue_depth', 'Reviews waiting in the ingest queue.',
+                                       review_ingest.depth))
+
+# Queues a review for the ingest workers and answers 202 with its status URL,
+# or 429 while the queue is full
+def enqueue_review(content):
+    error = review_item_error(content)
+    if error:
+        return jsonify({"Error": error['Error']}), error['status']
+    ticket = review_ingest.submit({field: content[field] for field in REVIEW_FIELDS + ['review_text'] if field in content})
+    if ticket is None:
+        response = jsonify({"Error": "Too many reviews are waiting to be written. Try again shortly"})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    status_url = f"{request.url_root}reviews/ingest/{ticket}"
+    response = jsonify({'state': ingest.QUEUED, 'self': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+# Status of a review queued by POST /reviews. Once written, `result` has the
+# same form as an entry of a POST /reviews:batch response.
+@app.route('/reviews/ingest/<ticket>', methods=['GET'])
+def get_review_ingest_status(ticket):
+    status = review_ingest.status(ticket) if review_ingest is not None else None
+    if status is None:
+        return jsonify({"Error": "No queued review with this id exists"}), 404
+    state, result = status
+    body = {'state': state, 'self': request.base_url}
+    if result is not None:
+        body['result'] = dict(result)
+        if result['status'] == 201:
+            body['result']['self'] = f"{request.url_root}reviews/{result['id']}"
+    return jsonify(body), 200
+
 # List a single review 
 @app.route('/reviews' + '/<int:review_id>', methods=['GET'])
 def get_review(review_id):
-    with db.connect() as conn:
-        # Fetch the review and the associated business details
-        stmnt = sqlalchemy.text(
-            '''
-            SELECT r.review_id, r.user_id, r.business_id, r.stars, r.review_text, b.name as business_name
-            FROM reviews r
-            JOIN businesses b ON r.business_id = b.business_id
-            WHERE r.review_id = :review_id
-            '''
-        )
-        # CHeck if the review exists
-        result = conn.execute(stmnt, {'review_id': review_id}).mappings().one_or_none()
+    try:
+        expand = requested_expansions(request.args, ('business',))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    engine = read_db()
+    review = cached_row(review_key(review_id))
+    # On a cache miss a revalidation reads only the version. An embedded
+    # business changes without a new version of the review, so expanded
+    # responses carry no ETag.
+    if review is None and request.if_none_match and not expand:
+        with engine.connect() as conn:
+            version = conn.execute(GET_REVIEW_VERSION_STMT, {'review_id': review_id}).scalar()
+        if version is not None and client_has(row_etag('r', review_id, version)):
+            return not_modified(row_etag('r', review_id, version))
+    if review is None:
+        with engine.connect() as conn:
+            # Fetch the review and check that it exists
+            result = conn.execute(GET_REVIEW_STMT, {'review_id': review_id}).one_or_none()
         if result is None:
             return jsonify(ERORR_NOT_FOUND_REVIEW), 404
-        
-        # Construct response
-        review = dict(result)
-        review['self'] = f"{request.url_root}reviews/{review['review_id']}"
-        review['business'] = f"{request.url_root}businesses/{review['business_id']}"
-        # Edit the response to remove review_text if it is empty
-        if review['review_text'] == '':
-            updated_review = {
-                'id': review['review_id'],
-                'user_id': review['user_id'],
-                'business': review['business'],
-                'stars': review['stars'],
-                'self': review['self']
-            }
-        else:
-            updated_review = {
-                'id': review['review_id'],
-                'user_id': review['user_id'],
-                'business': review['business'],
-                'stars': review['stars'],
-                'review_text': review['review_text'],
-                'self': review['self']}
+        review = Review.from_row(result)
+        cache_row(engine, review_key(review_id), review.fields())
+    else:
+        review = Review(**review)
+
+    etag = row_etag('r', review_id, review.version)
+    if not expand and client_has(etag):
+        return not_modified(etag)
+    # The response leaves review_text out if it is empty
+    url_root = request.url_root
+    review_dict = review.to_dict(url_root, omit_empty_text=True)
+    if 'business' in expand:
+        business = load_businesses(engine, [review.business_id]).get(review.business_id)
+        if business is not None:
+            review_dict['business'] = business.to_dict(url_root)
+        return json_response(review_dict), 200
+    response = json_response(review_dict)
+    response.set_etag(etag)
+    return response, 200
 
-        return jsonify(updated_review), 200
+GET_REVIEW_VERSION_STMT = statements.registry.add(
+    'get_review_version', 'SELECT version FROM reviews WHERE review_id = :review_id'
+)
+GET_REVIEW_STMT = statements.registry.add(
+    'get_review', f'SELECT {Review.columns()} FROM reviews WHERE review_id = :review_id'
+)
 
 # Edit a review
 @app.route('/reviews' + '/<int:review_id>', methods=['PUT'])
@@ -397,16 +1324,26 @@ def edit_review(review_id):
     # Check if all required fields are present
     if 'stars' not in content:
         return jsonify({"Error": "The request body is missing at least one of the required attributes"}), 400
+    if not valid_stars(content['stars']):
+        return jsonify({"Error": ERROR_INVALID_STARS}), 400
+    if 'review_text' in content and not valid_review_text(content['review_text']):
+        return jsonify({"Error": ERROR_INVALID_REVIEW_TEXT}), 400
+    expected = expected_version('r', review_id)
 
     with db.connect() as conn:
-        # Using mappings() to access columns by name
+        # Using mappings() to access columns by name. The row is locked so the
+        # stats adjustment below is based on the stars being replaced.
         existing_review = conn.execute(
-            sqlalchemy.text("SELECT * FROM reviews WHERE review_id = :review_id"),
+            statements.statement(EDIT_REVIEW_SELECT_SQL + for_update(conn)),
             {'review_id': review_id}
         ).mappings().one_or_none()  # Ensures that result can be accessed by column name
         
         if not existing_review:
             return jsonify({"Error": "No review with this review_id exists"}), 404
+        # The row is locked, so the version read here is the one being replaced
+        if expected is not None and expected != existing_review['version']:
+            conn.rollback()
+            return precondition_failed()
 
         # Update the review
         update_fields = {
@@ -414,85 +1351,346 @@ def edit_review(review_id):
             'stars': content['stars'],
             'review_text': content.get('review_text', existing_review['review_text'])  # Default to existing if not provided
         }
-        update_query = "UPDATE reviews SET stars = :stars, review_text = :review_text WHERE review_id = :review_id"
-        
-        conn.execute(sqlalchemy.text(update_query), update_fields)
+        conn.execute(EDIT_REVIEW_STMT, update_fields)
+        if existing_review['stars'] != content['stars']:
+            apply_stats_deltas(conn, [stats_delta(existing_review['business_id'],
+                                                  added=[content['stars']],
+                                                  removed=[existing_review['stars']])])
         conn.commit()
+        cache.invalidate(review_key(review_id))
+        review_search.update(review_id, update_fields['review_text'])
 
         # Construct the response
-        review_url = f"{request.url_root}reviews/{review_id}"
-        business_url = f"{request.url_root}businesses/{existing_review['business_id']}"
+        updated_review = Review(review_id, existing_review['user_id'], existing_review['business_id'],
+                                content['stars'], update_fields['review_text'])
+        response = json_response(updated_review.to_dict(request.url_root))
+        response.set_etag(row_etag('r', review_id, existing_review['version'] + 1))
+        return response, 200
 
-        updated_review = {
-            'id': review_id,
-            'user_id': existing_review['user_id'],
-            'business': business_url,
-            'stars': content['stars'],
-            'review_text': update_fields['review_text'],
-            'self': review_url
-        }
-        
-        return jsonify(updated_review), 200
+# The review is read with a dialect's locking clause appended
+EDIT_REVIEW_SELECT_SQL = "SELECT user_id, business_id, stars, review_text, version FROM reviews WHERE review_id = :review_id"
+EDIT_REVIEW_STMT = statements.registry.add(
+    'edit_review',
+    "UPDATE reviews SET stars = :stars, review_text = :review_text, version = version + 1 WHERE review_id = :review_id"
+)
 
 # Delete a review
 @app.route('/reviews' + '/<int:review_id>', methods=['DELETE'])
 def delete_review(review_id):
     with db.connect() as conn:
-        # First, check if the review exists
-        existing_review = conn.execute(
-            sqlalchemy.text("SELECT 1 FROM reviews WHERE review_id = :review_id"),
-            {'review_id': review_id}
-        ).scalar()
-        
-        if not existing_review:
-            return jsonify({"Error": "No review with this review_id exists"}), 404
-
-        # Delete the review
+        # Take the review out of its business's stats, reading its stars in the
+        # same statement, then delete it. If the review does not exist neither
+        # statement matches a row.
         conn.execute(
-            sqlalchemy.text("DELETE FROM reviews WHERE review_id = :review_id"),
+            statements.statement(STATS_REMOVE_REVIEW[conn.dialect.name]),
             {'review_id': review_id}
         )
+        result = conn.execute(DELETE_REVIEW_STMT, {'review_id': review_id})
+        if result.rowcount == 0:
+            conn.rollback()
+            return jsonify({"Error": "No review with this review_id exists"}), 404
         conn.commit()
+        cache.invalidate(review_key(review_id))
+        review_search.remove(review_id)
 
         # Return success status
         return ('', 204)
 
+DELETE_REVIEW_STMT = statements.registry.add('delete_review', "DELETE FROM reviews WHERE review_id = :review_id")
+
 # List all reviews for a user_id
 @app.route('/users/<int:user_id>/reviews', methods=['GET'])
 def get_users_reviews(user_id):
+    try:
+        fieldset = FieldSet.parse(Review, request.args.get('fields'))
+        expand = requested_expansions(request.args, ('business',))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    # Fetch all reviews for the specified user. The foreign key guarantees
+    # each review's business exists, so businesses is only joined to embed
+    # it. A user reviews a business at most once, so no business is read twice.
+    if 'business' in expand:
+        query = statements.statement(
+            f'SELECT {fieldset.columns("r")}, {Business.columns("b")} '
+            'FROM reviews r JOIN businesses b ON b.business_id = r.business_id WHERE r.user_id = :user_id'
+        )
+        business_start = len(fieldset.column_names)
+
+        def build(row, url_root):
+            review_dict = fieldset.row_dict(row, url_root)
+            review_dict['business'] = Business.from_row(row[business_start:]).to_dict(url_root)
+            return review_dict
+    else:
+        query = statements.statement(
+            f'SELECT {fieldset.columns()} FROM reviews WHERE user_id = :user_id'
+        )
+        build = fieldset.row_dict
+    not_found = {"Error": "No reviews found for this user"}
+    engine = read_db()
+    encoding = requested_encoding()
+    if encoding:
+        return stream_query(engine, query, {'user_id': user_id}, build, not_found,
+                            encoding, STREAM_BATCH_SIZE)
+
+    with engine.connect() as conn:
+        # Check if the user has any reviews
+        results = conn.execute(query, {'user_id': user_id}).all()
+    if not results:
+        return jsonify(not_found), 404
+
+    #Return the reviews
+    url_root = request.url_root
+    return json_response([build(row, url_root) for row in results]), 200
+
+###########################################################################
+#                                                                         #
+#                                 SEARCH                                  #
+#                                                                         #
+###########################################################################
+
+SEARCH_MAX_LIMIT = 100
+
+# On MySQL the search endpoints match against the FULLTEXT indexes. Other
+# databases are searched with these in-process indexes, which the write
+# handlers above keep current.
+business_search = InvertedIndex('businesses', 'business_id', 'name')
+review_search = InvertedIndex('reviews', 'review_id', 'review_text')
+
+# Runs a search over `text_column` of `table` and returns a page of `model`
+# entries, best match first. The `cursor` holds the score and id of the
+# last entry of the previous page.
+def search_page(model, table: str, id_column: str, text_column: str, index: InvertedIndex, path: str):
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"Error": "The q query parameter is required"}), 400
+    try:
+        limit = int(request.args.get('limit', 10))
+        cursor = request.args.get('cursor')
+        after = None
+        if cursor:
+            score, last_id = decode_cursor(cursor, 2)
+            after = (float(score), int(last_id))
+    except (TypeError, ValueError):
+        return jsonify({"Error": "Invalid query parameter"}), 400
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({"Error": f"limit must be from 1 to {SEARCH_MAX_LIMIT}"}), 400
+
+    engine = read_db()
+    if engine.dialect.name == 'mysql':
+        match = f'MATCH({text_column}) AGAINST (:q IN NATURAL LANGUAGE MODE)'
+        where = match
+        params = {'q': query, 'limit': limit}
+        if after is not None:
+            where += f' AND ({match} < :score OR ({match} = :score AND {id_column} > :last_id))'
+            params.update(score=after[0], last_id=after[1])
+        with engine.connect() as conn:
+            rows = conn.execute(statements.statement(
+                f'SELECT {model.columns()}, {match} AS score FROM {table} '
+                f'WHERE {where} ORDER BY score DESC, {id_column} LIMIT :limit'
+            ), params).all()
+        ranked = [(row[0], row[-1]) for row in rows]
+        found = {row[0]: model.from_row(row) for row in rows}
+    else:
+        # Built from the database the rows below are read from
+        index.build(engine)
+        ranked = index.search(query, limit, after)
+        found = {}
+        if ranked:
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    statements.statement(f'SELECT {model.columns()} FROM {table} WHERE {id_column} IN :ids',
+                                         expanding=('ids',)),
+                    {'ids': [doc_id for doc_id, _ in ranked]}
+                ).all()
+            found = {row[0]: model.from_row(row) for row in rows}
+
+    url_root = request.url_root
+    entries = []
+    for doc_id, score in ranked:
+        if doc_id in found:
+            entry = found[doc_id].to_dict(url_root)
+            entry['score'] = round(score, 4)
+            entries.append(entry)
+    next_url = None
+    if len(ranked) == limit:
+        next_query = urllib.parse.urlencode({'q': query, 'limit': limit, 'cursor': encode_cursor(ranked[-1][1], ranked[-1][0])})
+        next_url = f'{url_root}{path}?{next_query}'
+    return json_response({'entries': entries, 'next': next_url}), 200
+
+# Search businesses by name
+@app.route('/businesses/search', methods=['GET'])
+def search_businesses():
+    return search_page(Business, 'businesses', 'business_id', 'name', business_search, 'businesses/search')
+
+# Search reviews by their text
+@app.route('/reviews/search', methods=['GET'])
+def search_reviews():
+    return search_page(Review, 'reviews', 'review_id', 'review_text', review_search, 'reviews/search')
+
+###########################################################################
+#                                                                         #
+#                             BUSINESS STATS                              #
+#                                                                         #
+###########################################################################
+
+STAR_VALUES = [1, 2, 3, 4, 5]
+
+# create 'business_stats' table, holding a running review count, star sum and
+# star histogram per business. Rows are removed with their business by the FK
+# cascade. When the table is new it is filled from the existing businesses
+# and reviews.
+def create_business_stats_table(db: sqlalchemy.engine.base.Engine) -> None:
+    if sqlalchemy.inspect(db).has_table('business_stats'):
+        return
     with db.connect() as conn:
-        # Fetch all reviews for the specified user
-        query = sqlalchemy.text(
+        conn.execute(
+            sqlalchemy.text(
+                '''
+                CREATE TABLE IF NOT EXISTS business_stats (
+                    business_id BIGINT UNSIGNED PRIMARY KEY,
+                    review_count INT NOT NULL DEFAULT 0,
+                    star_sum BIGINT NOT NULL DEFAULT 0,
+                    stars_1 INT NOT NULL DEFAULT 0,
+                    stars_2 INT NOT NULL DEFAULT 0,
+                    stars_3 INT NOT NULL DEFAULT 0,
+                    stars_4 INT NOT NULL DEFAULT 0,
+                    stars_5 INT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (business_id) REFERENCES businesses(business_id) ON DELETE CASCADE
+                );
+                '''
+            )
+        )
+        fill_business_stats(conn)
+        conn.commit()
+
+# Adds the stats row of every business that has none, counted from its
+# reviews. Used when the table is created and after a bulk load that
+# bypasses the handlers.
+def fill_business_stats(conn) -> None:
+    conn.execute(
+        sqlalchemy.text(
             '''
-            SELECT r.review_id, r.user_id, r.business_id, r.stars, r.review_text, b.name as business_name
-            FROM reviews r
-            JOIN businesses b ON r.business_id = b.business_id
-            WHERE r.user_id = :user_id
+            INSERT INTO business_stats (business_id, review_count, star_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+            SELECT b.business_id, COUNT(r.stars), COALESCE(SUM(r.stars), 0),
+                   SUM(CASE WHEN r.stars = 1 THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN r.stars = 2 THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN r.stars = 3 THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN r.stars = 4 THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN r.stars = 5 THEN 1 ELSE 0 END)
+            FROM businesses b LEFT JOIN reviews r ON r.business_id = b.business_id
+            WHERE NOT EXISTS (SELECT 1 FROM business_stats s WHERE s.business_id = b.business_id)
+            GROUP BY b.business_id
             '''
         )
-        # Check if the user has any reviews
-        results = conn.execute(query, {'user_id': user_id}).mappings().all()
-        if not results:
-            return jsonify({"Error": "No reviews found for this user"}), 404
-
-        #Return the reviews
-        reviews = []
-        for review in results:
-            review_dict = {
-                'id': review['review_id'],
-                'user_id': review['user_id'],
-                'business': f"{request.url_root}businesses/{review['business_id']}",
-                'stars': review['stars'],
-                'review_text': review['review_text'],
-                'self': f"{request.url_root}reviews/{review['review_id']}"
-            }
-            reviews.append(review_dict)
-
-        return jsonify(reviews), 200
+    )
+
+# Checks that a star rating can be counted in the histogram
+def valid_stars(stars) -> bool:
+    return isinstance(stars, int) and not isinstance(stars, bool) and stars in STAR_VALUES
+
+# Builds the parameters that move a business's stats by the star ratings of
+# the reviews `added` and `removed`
+def stats_delta(business_id, added=(), removed=()) -> dict:
+    delta = {'business_id': business_id,
+             'review_count': len(added) - len(removed),
+             'star_sum': sum(added) - sum(removed)}
+    for value in STAR_VALUES:
+        delta[f'stars_{value}'] = added.count(value) - removed.count(value)
+    return delta
+
+STATS_UPSERT = {
+    'mysql': 'ON DUPLICATE KEY UPDATE review_count = review_count + VALUES(review_count), '
+             'star_sum = star_sum + VALUES(star_sum), '
+             'stars_1 = stars_1 + VALUES(stars_1), stars_2 = stars_2 + VALUES(stars_2), '
+             'stars_3 = stars_3 + VALUES(stars_3), stars_4 = stars_4 + VALUES(stars_4), '
+             'stars_5 = stars_5 + VALUES(stars_5)',
+    'sqlite': 'ON CONFLICT (business_id) DO UPDATE SET review_count = review_count + excluded.review_count, '
+              'star_sum = star_sum + excluded.star_sum, '
+              'stars_1 = stars_1 + excluded.stars_1, stars_2 = stars_2 + excluded.stars_2, '
+              'stars_3 = stars_3 + excluded.stars_3, stars_4 = stars_4 + excluded.stars_4, '
+              'stars_5 = stars_5 + excluded.stars_5',
+}
+
+# Removes one review from its business's stats, reading the review's stars in
+# the same statement
+STATS_REMOVE_REVIEW = {
+    'mysql': 'UPDATE business_stats s JOIN reviews r ON r.business_id = s.business_id '
+             'SET s.review_count = s.review_count - 1, s.star_sum = s.star_sum - r.stars, '
+             's.stars_1 = s.stars_1 - (r.stars = 1), s.stars_2 = s.stars_2 - (r.stars = 2), '
+             's.stars_3 = s.stars_3 - (r.stars = 3), s.stars_4 = s.stars_4 - (r.stars = 4), '
+             's.stars_5 = s.stars_5 - (r.stars = 5) '
+             'WHERE r.review_id = :review_id',
+    'sqlite': 'UPDATE business_stats '
+              'SET review_count = review_count - 1, star_sum = star_sum - r.stars, '
+              'stars_1 = stars_1 - (r.stars = 1), stars_2 = stars_2 - (r.stars = 2), '
+              'stars_3 = stars_3 - (r.stars = 3), stars_4 = stars_4 - (r.stars = 4), '
+              'stars_5 = stars_5 - (r.stars = 5) '
+              'FROM reviews r WHERE r.review_id = :review_id AND business_stats.business_id = r.business_id',
+}
+
+# Applies stats deltas inside the caller's transaction, creating the row for
+# a business's first review
+def apply_stats_deltas(conn, deltas: list) -> None:
+    conn.execute(stats_upsert_stmt(conn.dialect.name), deltas)
+
+def stats_upsert_stmt(dialect_name: str) -> sqlalchemy.TextClause:
+    return statements.statement(
+        'INSERT INTO business_stats (business_id, review_count, star_sum, stars_1, stars_2, stars_3, stars_4, stars_5) '
+        'VALUES (:business_id, :review_count, :star_sum, :stars_1, :stars_2, :stars_3, :stars_4, :stars_5) '
+        + STATS_UPSERT[dialect_name]
+    )
+
+# Shapes the stats columns, in STATS_FIELDS order, for a response. Every
+# column may be None, for a business whose stats row is missing.
+def stats_dict(values) -> dict:
+    review_count, star_sum, *histogram = values
+    review_count = review_count or 0
+    star_sum = star_sum or 0
+    return {
+        'review_count': review_count,
+        'average_stars': round(star_sum / review_count, 2) if review_count else None,
+        'histogram': {str(value): count or 0 for value, count in zip(STAR_VALUES, histogram)}
+    }
+
+# Checks for `stats` in the comma separated `include` query parameter
+def include_stats() -> bool:
+    return 'stats' in request.args.get('include', '').split(',')
+
+STATS_FIELDS = ['review_count', 'star_sum', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+STATS_COLUMNS = 's.review_count, s.star_sum, s.stars_1, s.stars_2, s.stars_3, s.stars_4, s.stars_5'
+
+GET_STATS_STMT = statements.registry.add(
+    'get_stats', f'SELECT {STATS_COLUMNS} FROM business_stats s WHERE s.business_id = :business_id'
+)
+LOAD_STATS_STMT = statements.registry.add(
+    'load_stats', f'SELECT s.business_id, {STATS_COLUMNS} FROM business_stats s WHERE s.business_id IN :ids',
+    expanding=('ids',)
+)
+GET_BUSINESS_STATS_STMT = statements.registry.add(
+    'get_business_stats',
+    f'SELECT b.business_id, {STATS_COLUMNS} '
+    'FROM businesses b LEFT JOIN business_stats s ON s.business_id = b.business_id '
+    'WHERE b.business_id = :business_id'
+)
+
+# Return the rating stats of a business
+@app.route('/businesses/<int:id>/stats', methods=['GET'])
+def get_business_stats(id):
+    with read_db().connect() as conn:
+        result = conn.execute(GET_BUSINESS_STATS_STMT, {'business_id': id}).one_or_none()
+
+    if result is None:
+        return jsonify(ERORR_NOT_FOUND), 404
+    stats = stats_dict(result[1:])
+    url_root = request.url_root
+    stats['business'] = f"{url_root}businesses/{id}"
+    stats['self'] = f"{url_root}businesses/{id}/stats"
+    return jsonify(stats), 200
 
 ##########################
+startup_seconds['import'] = time.perf_counter() - IMPORT_STARTED
+
 if __name__ == '__main__':
-    init_db()
-    create_table(db)
-    create_reviews_table(db)
+    with profiling.profile_block('startup schema'):
+        ensure_db()
     app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+Request, query and connection pool metrics in the Prometheus text format.
+
+Flask request hooks time every request by route, and SQLAlchemy engine
+events count the statements each request runs and the time spent in them.
+Connection checkouts are timed by wrapping the engine's `raw_connection`,
+since the pool has no event for the start of a checkout. Each observation
+is a dict lookup, a bisect and a few additions under one lock, so the
+instrumentation can stay on in production.
+
+Every process keeps its own registry. With several gunicorn workers a
+scrape of /metrics reports the worker that served it.
+"""
+import bisect
+import threading
+import time
+
+from flask import g, has_request_context, request
+import sqlalchemy
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{label}="{value}"' for label, value in zip(labels, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        # Per label set: [count per bucket, with the last for +Inf, sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self.lock:
+            series = {label_values: (list(counts), total) for label_values, (counts, total) in self.series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = format_value(float(bound)) if bound != '+Inf' else bound
+                yield f'{self.name}_bucket', format_labels(self.labels, label_values, f'le="{le}"'), cumulative
+            yield f'{self.name}_sum', format_labels(self.labels, label_values), total
+            yield f'{self.name}_count', format_labels(self.labels, label_values), cumulative
+
+
+class Gauge:
+    """A value read from `read()` when the registry is scraped."""
+
+    def __init__(self, name: str, help: str, read, kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        value = self.read()
+        if value is not None:
+            yield self.name, '', value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.add(Counter(
+    'http_requests_total', 'Requests served, by route, method and status.', ('route', 'method', 'status')))
+request_seconds = registry.add(Histogram(
+    'http_request_duration_seconds', 'Time from the start of a request to the end of its response, by route.', LATENCY_BUCKETS, ('route', 'method')))
+request_db_seconds = registry.add(Histogram(
+    'http_request_db_seconds', 'Time spent executing SQL per request, by route.', LATENCY_BUCKETS, ('route', 'method')))
+request_queries = registry.add(Histogram(
+    'http_request_queries', 'SQL statements executed per request, by route.', QUERY_COUNT_BUCKETS, ('route', 'method')))
+query_seconds = registry.add(Histogram(
+    'db_query_duration_seconds', 'Time to execute one SQL statement.', LATENCY_BUCKETS))
+pool_wait_seconds = registry.add(Histogram(
+    'db_pool_checkout_seconds', 'Time to get a connection from the pool, including opening a new one.',
+    LATENCY_BUCKETS))
+
+
+def route_labels() -> tuple:
+    rule = request.url_rule
+    return (rule.rule if rule is not None else 'unmatched', request.method)
+
+
+def before_request() -> None:
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_db_seconds = 0.0
+
+
+def after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+# Runs once the response is sent, also when the view raised. A streamed
+# response keeps its request context until the last row is written, so its
+# time and queries are included.
+def teardown_request(error=None) -> None:
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    labels = route_labels()
+    request_seconds.observe(time.perf_counter() - start, *labels)
+    request_db_seconds.observe(g.metrics_db_seconds, *labels)
+    request_queries.observe(g.metrics_queries, *labels)
+    status = g.get('metrics_status', 500 if error is not None else 200)
+    requests_total.inc(*labels, str(status))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def record_query(conn) -> None:
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    query_seconds.observe(elapsed)
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_queries += 1
+        g.metrics_db_seconds += elapsed
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_query(conn)
+
+
+# A statement that raises, such as an INSERT hitting a unique key, skips
+# after_cursor_execute but still took a round trip
+def handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None and conn.info.get('metrics_query_start'):
+        record_query(conn)
+
+
+def instrument_app(app) -> None:
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+
+
+# The pool of the instrumented engine, read by the pool gauges
+pool = None
+
+
+def pool_gauge(read):
+    def value():
+        if pool is None or not hasattr(pool, 'checkedout'):
+            return None
+        return read(pool)
+    return value
+
+
+# A negative max_overflow means the pool has no upper bound
+def pool_capacity(pool):
+    return pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+
+
+registry.add(Gauge('db_pool_checked_out', 'Connections currently checked out of the pool.',
+                   pool_gauge(lambda pool: pool.checkedout())))
+registry.add(Gauge('db_pool_size', 'Connections the pool keeps open.',
+                   pool_gauge(lambda pool: pool.size())))
+registry.add(Gauge('db_pool_capacity', 'Connections the pool can hand out at once, including overflow.',
+                   pool_gauge(pool_capacity)))
+
+
+def instrument_engine(engine: sqlalchemy.engine.base.Engine, report_pool: bool = True) -> None:
+    """
+    Times statements and connection checkouts on `engine`, and points the
+    pool gauges at its pool unless `report_pool` is False.
+    """
+    global pool
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    sqlalchemy.event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    sqlalchemy.event.listen(engine, 'handle_error', handle_error)
+
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        start = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - start)
+
+    engine.raw_connection = timed_raw_connection
+    if report_pool:
+        pool = engine.pool
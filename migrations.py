@@ -0,0 +1,189 @@
+import logging
+
+import sqlalchemy
+
+logger = logging.getLogger()
+
+# Versioned schema migrations. Each applied step is recorded as a row in
+# `schema_version`, and `migrate` runs the steps newer than the highest
+# recorded version in order. MySQL commits DDL implicitly, so a step may be
+# cut short after partly applying; every step therefore checks what already
+# exists and can safely run again.
+
+
+class MigrationError(Exception):
+    pass
+
+
+def has_index(conn, table: str, name: str) -> bool:
+    return any(index['name'] == name for index in sqlalchemy.inspect(conn).get_indexes(table))
+
+
+def has_column(conn, table: str, name: str) -> bool:
+    return any(column['name'] == name for column in sqlalchemy.inspect(conn).get_columns(table))
+
+
+def create_index(conn, table: str, name: str, columns: str, unique: bool = False, fulltext: bool = False) -> None:
+    if has_index(conn, table, name):
+        return
+    kind = 'UNIQUE INDEX' if unique else 'FULLTEXT INDEX' if fulltext else 'INDEX'
+    conn.execute(sqlalchemy.text(f'CREATE {kind} {name} ON {table} ({columns})'))
+
+
+# get_owners_businesses filters on owner_id
+def add_businesses_owner_index(conn) -> None:
+    create_index(conn, 'businesses', 'idx_businesses_owner_id', 'owner_id')
+
+
+# get_users_reviews filters on user_id
+def add_reviews_user_index(conn) -> None:
+    create_index(conn, 'reviews', 'idx_reviews_user_id', 'user_id')
+
+
+# A user may review a business once. create_review relies on this index for
+# its 409 response instead of looking for an existing review first.
+def add_reviews_business_user_unique(conn) -> None:
+    duplicates = conn.execute(sqlalchemy.text(
+        'SELECT COUNT(*) FROM (SELECT business_id, user_id FROM reviews '
+        'GROUP BY business_id, user_id HAVING COUNT(*) > 1) d'
+    )).scalar()
+    if duplicates:
+        raise MigrationError(
+            f'{duplicates} (business_id, user_id) pairs have more than one review; '
+            'remove the extra reviews before adding uq_reviews_business_user'
+        )
+    create_index(conn, 'reviews', 'uq_reviews_business_user', 'business_id, user_id', unique=True)
+
+
+# Row versions back the ETags and If-Match checks. Every UPDATE of a business
+# or review increments its version.
+def add_row_versions(conn) -> None:
+    for table in ('businesses', 'reviews'):
+        if not has_column(conn, table, 'version'):
+            conn.execute(sqlalchemy.text(f'ALTER TABLE {table} ADD COLUMN version INT NOT NULL DEFAULT 1'))
+
+
+# Read replicas report their lag by the age of the heartbeat row they hold.
+# The replica router rewrites the row on the primary every few seconds.
+def add_replication_heartbeat(conn) -> None:
+    conn.execute(sqlalchemy.text(
+        'CREATE TABLE IF NOT EXISTS replication_heartbeat (id INT NOT NULL PRIMARY KEY, beat_at DOUBLE NOT NULL)'
+    ))
+    if conn.execute(sqlalchemy.text('SELECT 1 FROM replication_heartbeat WHERE id = 1')).first() is None:
+        conn.execute(sqlalchemy.text('INSERT INTO replication_heartbeat (id, beat_at) VALUES (1, 0)'))
+
+
+# The search endpoints match against these on MySQL. Other databases are
+# searched with the in-process index in search.py.
+def add_fulltext_indexes(conn) -> None:
+    if conn.dialect.name != 'mysql':
+        return
+    create_index(conn, 'businesses', 'ft_businesses_name', 'name', fulltext=True)
+    create_index(conn, 'reviews', 'ft_reviews_review_text', 'review_text', fulltext=True)
+
+
+# Filters and sorts on GET /businesses. Every business gets a stats row, so
+# the rating sort can walk business_stats in index order. `rating` is a
+# generated column, so the database keeps it in step with every stats
+# update. It is 0 rather than NULL for a business without reviews, which
+# keeps the cursor predicate of the sort a plain range on (rating, business_id).
+def add_business_filter_indexes(conn) -> None:
+    create_index(conn, 'businesses', 'idx_businesses_state_city', 'state, city')
+    create_index(conn, 'businesses', 'idx_businesses_zip_code', 'zip_code')
+    conn.execute(sqlalchemy.text(
+        'INSERT INTO business_stats (business_id) SELECT b.business_id FROM businesses b '
+        'WHERE NOT EXISTS (SELECT 1 FROM business_stats s WHERE s.business_id = b.business_id)'
+    ))
+    if not has_column(conn, 'business_stats', 'rating'):
+        conn.execute(sqlalchemy.text(
+            'ALTER TABLE business_stats ADD COLUMN rating DOUBLE GENERATED ALWAYS AS '
+            '(CASE WHEN review_count > 0 THEN star_sum * 1.0 / review_count ELSE 0 END) VIRTUAL NOT NULL'
+        ))
+    create_index(conn, 'business_stats', 'idx_business_stats_rating', 'rating, business_id')
+
+
+# Results of reviews written by the ingest workers, so that any worker can
+# answer GET /reviews/ingest/<ticket>. Rows older than the status retention
+# are deleted by finished_at.
+def add_review_ingest_results(conn) -> None:
+    conn.execute(sqlalchemy.text(
+        'CREATE TABLE IF NOT EXISTS review_ingest_results ('
+        'ticket CHAR(32) NOT NULL PRIMARY KEY, status SMALLINT NOT NULL, review_id BIGINT UNSIGNED, '
+        'error VARCHAR(255), finished_at DOUBLE NOT NULL)'
+    ))
+    create_index(conn, 'review_ingest_results', 'idx_review_ingest_results_finished_at', 'finished_at')
+
+
+MIGRATIONS = [
+    (1, 'Index businesses.owner_id', add_businesses_owner_index),
+    (2, 'Index reviews.user_id', add_reviews_user_index),
+    (3, 'Unique reviews (business_id, user_id)', add_reviews_business_user_unique),
+    (4, 'Row versions on businesses and reviews', add_row_versions),
+    (5, 'Replication heartbeat', add_replication_heartbeat),
+    (6, 'FULLTEXT indexes for search', add_fulltext_indexes),
+    (7, 'Business filter indexes and rating sort key', add_business_filter_indexes),
+    (8, 'Shared review ingest results', add_review_ingest_results),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def create_schema_version_table(conn) -> None:
+    conn.execute(sqlalchemy.text(
+        '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ))
+    conn.commit()
+
+
+def current_version(conn) -> int:
+    return conn.execute(sqlalchemy.text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+
+
+def schema_is_current(db: sqlalchemy.engine.base.Engine) -> bool:
+    """
+    Tells with one query whether every migration has been applied, so a
+    starting worker can skip the DDL. A missing schema_version table means
+    the schema has never been set up.
+    """
+    try:
+        with db.connect() as conn:
+            return current_version(conn) >= LATEST_VERSION
+    except sqlalchemy.exc.DBAPIError:
+        return False
+
+
+def migrate(db: sqlalchemy.engine.base.Engine) -> int:
+    """
+    Applies the pending migrations and returns the resulting schema version.
+
+    On MySQL a named lock keeps workers that start together from running
+    the same steps at once.
+    """
+    with db.connect() as conn:
+        create_schema_version_table(conn)
+        locked = conn.dialect.name == 'mysql'
+        if locked and not conn.execute(sqlalchemy.text("SELECT GET_LOCK('schema_migrations', 60)")).scalar():
+            raise MigrationError('Timed out waiting for the schema_migrations lock')
+        try:
+            version = current_version(conn)
+            for step_version, description, step in MIGRATIONS:
+                if step_version <= version:
+                    continue
+                logger.info('Applying migration %d: %s', step_version, description)
+                step(conn)
+                conn.execute(
+                    sqlalchemy.text('INSERT INTO schema_version (version, description) VALUES (:version, :description)'),
+                    {'version': step_version, 'description': description}
+                )
+                conn.commit()
+                version = step_version
+            return version
+        finally:
+            if locked:
+                conn.execute(sqlalchemy.text("SELECT RELEASE_LOCK('schema_migrations')"))
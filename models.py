@@ -0,0 +1,168 @@
+"""
+Row models for the business and review resources.
+
+Each model is built straight from a result row, positionally, in the order
+of its COLUMNS, and shapes itself for a response with `to_dict`. The
+`url_root` passed to `to_dict` is read once per request by the handler.
+
+A FieldSet narrows a model to the response fields named by a `?fields=`
+parameter, and the SELECT list to the columns those fields are built from.
+"""
+
+
+def select_list(columns: tuple, alias: str = '') -> str:
+    prefix = f'{alias}.' if alias else ''
+    return ', '.join(prefix + column for column in columns)
+
+
+class Business:
+    __slots__ = ('id', 'owner_id', 'name', 'street_address', 'city', 'state', 'zip_code', 'version')
+
+    COLUMNS = ('business_id', 'owner_id', 'name', 'street_address', 'city', 'state', 'zip_code', 'version')
+
+    # The column each response field is built from
+    FIELD_COLUMNS = {
+        'id': 'business_id',
+        'owner_id': 'owner_id',
+        'name': 'name',
+        'street_address': 'street_address',
+        'city': 'city',
+        'state': 'state',
+        'zip_code': 'zip_code',
+        'self': 'business_id',
+    }
+
+    def __init__(self, id, owner_id, name, street_address, city, state, zip_code, version=None):
+        self.id = id
+        self.owner_id = owner_id
+        self.name = name
+        self.street_address = street_address
+        self.city = city
+        self.state = state
+        self.zip_code = zip_code
+        self.version = version
+
+    # Builds the model from the leading COLUMNS of a row; columns selected
+    # after them, such as stats, are left to the caller
+    @classmethod
+    def from_row(cls, row) -> 'Business':
+        return cls(*row[:8])
+
+    @classmethod
+    def columns(cls, alias: str = '') -> str:
+        return select_list(cls.COLUMNS, alias)
+
+    # The cache holds plain dicts, keyed by the slot names
+    def fields(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def to_dict(self, url_root: str) -> dict:
+        return {
+            'id': self.id,
+            'owner_id': self.owner_id,
+            'name': self.name,
+            'street_address': self.street_address,
+            'city': self.city,
+            'state': self.state,
+            'zip_code': self.zip_code,
+            'self': f'{url_root}businesses/{self.id}'
+        }
+
+
+class Review:
+    __slots__ = ('id', 'user_id', 'business_id', 'stars', 'review_text', 'version')
+
+    COLUMNS = ('review_id', 'user_id', 'business_id', 'stars', 'review_text', 'version')
+
+    FIELD_COLUMNS = {
+        'id': 'review_id',
+        'user_id': 'user_id',
+        'business': 'business_id',
+        'stars': 'stars',
+        'review_text': 'review_text',
+        'self': 'review_id',
+    }
+
+    def __init__(self, id, user_id, business_id, stars, review_text, version=None):
+        self.id = id
+        self.user_id = user_id
+        self.business_id = business_id
+        self.stars = stars
+        self.review_text = review_text
+        self.version = version
+
+    @classmethod
+    def from_row(cls, row) -> 'Review':
+        return cls(*row[:6])
+
+    @classmethod
+    def columns(cls, alias: str = '') -> str:
+        return select_list(cls.COLUMNS, alias)
+
+    def fields(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    # GET /reviews/<id> leaves review_text out when it is empty; the other
+    # responses always include it
+    def to_dict(self, url_root: str, omit_empty_text: bool = False) -> dict:
+        review = {
+            'id': self.id,
+            'user_id': self.user_id,
+            'business': f'{url_root}businesses/{self.business_id}',
+            'stars': self.stars,
+            'review_text': self.review_text,
+            'self': f'{url_root}reviews/{self.id}'
+        }
+        if omit_empty_text and self.review_text == '':
+            del review['review_text']
+        return review
+
+
+class FieldSet:
+    """
+    The response fields of `model` a client asked for, and the columns to
+    read for them, in COLUMNS order. The id column is always read first, for
+    cursors and `self` links, and `extra` columns such as version are read
+    for the handler's own use. Without a selection every field is returned.
+    """
+
+    def __init__(self, model, names: tuple = None, extra: tuple = ()):
+        self.model = model
+        self.names = names
+        if names is None:
+            needed = set(model.COLUMNS)
+        else:
+            needed = {model.COLUMNS[0], *extra, *(model.FIELD_COLUMNS[name] for name in names)}
+        self.column_names = tuple(column for column in model.COLUMNS if column in needed)
+        self.slots = tuple(model.__slots__[model.COLUMNS.index(column)] for column in self.column_names)
+
+    @classmethod
+    def parse(cls, model, value: str, extra: tuple = ()) -> 'FieldSet':
+        """Reads a comma separated `fields` parameter, raising ValueError on an unknown field."""
+        if not value:
+            return cls(model, None, extra)
+        names = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in names if name not in model.FIELD_COLUMNS]
+        if unknown or not names:
+            raise ValueError(f"Unknown field: {', '.join(unknown)}" if unknown else 'fields is empty')
+        return cls(model, names, extra)
+
+    def columns(self, alias: str = '') -> str:
+        return select_list(self.column_names, alias)
+
+    # Columns selected after the field set's are left to the caller
+    def from_row(self, row):
+        if self.names is None:
+            return self.model.from_row(row)
+        values = dict.fromkeys(self.model.__slots__)
+        values.update(zip(self.slots, row))
+        return self.model(**values)
+
+    def to_dict(self, instance, url_root: str) -> dict:
+        shaped = instance.to_dict(url_root)
+        if self.names is None:
+            return shaped
+        return {name: shaped[name] for name in self.names}
+
+    def row_dict(self, row, url_root: str) -> dict:
+        return self.to_dict(self.from_row(row), url_root)
@@ -0,0 +1,31 @@
+import base64
+import binascii
+import json
+
+# Opaque cursors for keyset pagination. A cursor carries the sort key of the
+# last row on a page so the next page can resume with `WHERE key > :last`
+# instead of making the database skip over OFFSET rows.
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, size: int) -> list:
+    """
+    Decodes a cursor produced by encode_cursor.
+
+    Raises ValueError if the token is malformed or does not hold exactly
+    `size` scalar values.
+    """
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    if not all(isinstance(v, (int, float, str)) and not isinstance(v, bool) for v in values):
+        raise ValueError('Invalid cursor')
+    return values
@@ -0,0 +1,254 @@
+"""
+Opt-in sampling profiler and slow query log.
+
+Both are off unless configured, through the environment at startup or the
+/admin/profiling endpoint at runtime:
+
+    PROFILE_SAMPLE_RATE   fraction of requests to profile, 0 to 1
+    PROFILE_INTERVAL_MS   time between stack samples of a profiled request
+    PROFILE_OUTPUT        file the aggregated stacks are written to at exit
+    SLOW_QUERY_MS         log statements that take longer than this
+    SLOW_QUERY_EXPLAIN    also log the EXPLAIN plan of slow statements
+
+A profiled request's thread is sampled by one background thread, and the
+stacks are aggregated in the folded format read by flamegraph.pl and
+speedscope, one `frame;frame;... count` line per distinct stack, rooted at
+the route. The EXPLAIN of a slow statement runs on its own connection while
+the request waits, so turn it on only while investigating.
+"""
+import atexit
+import collections
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+import sqlalchemy
+
+logger = logging.getLogger()
+
+# Statements EXPLAIN accepts on both MySQL and SQLite
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT')
+# Longest sampling interval the settings endpoint accepts
+MAX_INTERVAL_MS = 1000
+EXPLAIN_PREFIX = {
+    'mysql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+# Checks that a setting is a finite JSON number, not a boolean
+def finite_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class Settings:
+    def __init__(self):
+        self.sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.interval = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+        slow_query_ms = os.environ.get('SLOW_QUERY_MS')
+        self.slow_query_seconds = float(slow_query_ms) / 1000 if slow_query_ms else None
+        self.explain = env_flag('SLOW_QUERY_EXPLAIN')
+
+    def as_dict(self) -> dict:
+        return {
+            'sample_rate': self.sample_rate,
+            'interval_ms': self.interval * 1000,
+            'slow_query_ms': self.slow_query_seconds * 1000 if self.slow_query_seconds is not None else None,
+            'explain': self.explain,
+        }
+
+    def update(self, content: dict) -> None:
+        """Applies the settings in `content`, raising ValueError if any is invalid."""
+        sample_rate = content.get('sample_rate', self.sample_rate)
+        interval_ms = content.get('interval_ms', self.interval * 1000)
+        slow_query_ms = content.get('slow_query_ms', self.as_dict()['slow_query_ms'])
+        explain = content.get('explain', self.explain)
+        # Only the settings sent are checked, so one set out of range from the
+        # environment does not block changing the others
+        if 'sample_rate' in content and not (finite_number(sample_rate) and 0 <= sample_rate <= 1):
+            raise ValueError('sample_rate must be a number from 0 to 1')
+        if 'interval_ms' in content and not (finite_number(interval_ms) and 0 < interval_ms <= MAX_INTERVAL_MS):
+            raise ValueError(f'interval_ms must be a positive number of at most {MAX_INTERVAL_MS}')
+        if slow_query_ms is not None and not (finite_number(slow_query_ms) and slow_query_ms >= 0):
+            raise ValueError('slow_query_ms must be null or a number of at least 0')
+        if not isinstance(explain, bool):
+            raise ValueError('explain must be true or false')
+        slow_query_seconds = slow_query_ms / 1000 if slow_query_ms is not None else None
+        self.sample_rate = float(sample_rate)
+        self.interval = interval_ms / 1000
+        self.slow_query_seconds = slow_query_seconds
+        self.explain = explain
+
+
+settings = Settings()
+
+
+class Sampler:
+    """Samples the stacks of registered threads from a background thread."""
+
+    def __init__(self):
+        self.stacks = collections.Counter()
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, label: str) -> None:
+        with self.lock:
+            self.active[threading.get_ident()] = label
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='profiling-sampler', daemon=True)
+                self.thread.start()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def run(self) -> None:
+        while True:
+            time.sleep(settings.interval)
+            with self.lock:
+                active = dict(self.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, label in active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = fold(frame, label)
+                    with self.lock:
+                        self.stacks[stack] += 1
+
+    def folded(self) -> str:
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stacks.clear()
+
+
+# Outermost frame first, as the folded format expects
+def fold(frame, label: str) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    names.append(label)
+    return ';'.join(reversed(names))
+
+
+sampler = Sampler()
+
+
+def write_output() -> None:
+    path = os.environ.get('PROFILE_OUTPUT')
+    if path and sampler.stacks:
+        with open(path, 'w') as output:
+            output.write(sampler.folded())
+
+
+atexit.register(write_output)
+
+
+class profile_block:
+    """
+    Profiles the current thread for the duration of the block, subject to
+    the sample rate. Used for work outside requests, such as creating the
+    schema at startup.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.sampled = False
+
+    def __enter__(self):
+        self.sampled = settings.sample_rate > 0 and random.random() < settings.sample_rate
+        if self.sampled:
+            sampler.start(self.label)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.sampled:
+            sampler.stop()
+
+
+def before_request() -> None:
+    if settings.sample_rate > 0 and random.random() < settings.sample_rate:
+        rule = request.url_rule
+        sampler.start(f"{request.method} {rule.rule if rule is not None else 'unmatched'}")
+        g.profiled = True
+
+
+def teardown_request(error=None) -> None:
+    if g.pop('profiled', False):
+        sampler.stop()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if settings.slow_query_seconds is not None:
+        conn.info.setdefault('profiling_query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('profiling_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    threshold = settings.slow_query_seconds
+    if threshold is None or elapsed < threshold or conn.info.get('profiling_explaining'):
+        return
+    route = f'{request.method} {request.path}' if has_request_context() else 'outside a request'
+    logger.warning('Slow query (%.1f ms, %s): %s %r', elapsed * 1000, route,
+                   ' '.join(statement.split()), parameters)
+    if settings.explain and not executemany:
+        explain(conn.engine, statement, parameters)
+
+
+# A statement that raises before before_cursor_execute has pushed no start time
+def handle_error(exception_context):
+    conn = exception_context.connection
+    if (conn is not None and exception_context.execution_context is not None
+            and conn.info.get('profiling_query_start')):
+        conn.info['profiling_query_start'].pop()
+
+
+# Logs the plan of a statement in the driver's own parameter style
+def explain(engine: sqlalchemy.engine.base.Engine, statement: str, parameters) -> None:
+    prefix = EXPLAIN_PREFIX.get(engine.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return
+    try:
+        with engine.connect() as conn:
+            # The EXPLAIN is not itself reported as a slow query
+            conn.connection.info['profiling_explaining'] = True
+            try:
+                plan = conn.exec_driver_sql(prefix + statement, parameters).all()
+            finally:
+                conn.connection.info['profiling_explaining'] = False
+            conn.rollback()
+    except Exception as e:
+        logger.warning('Unable to EXPLAIN slow query: %s', e)
+        return
+    logger.warning('Plan:\n%s', '\n'.join(' | '.join(str(column) for column in row) for row in plan))
+
+
+def instrument_app(app) -> None:
+    app.before_request(before_request)
+    app.teardown_request(teardown_request)
+
+
+def instrument_engine(engine: sqlalchemy.engine.base.Engine) -> None:
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    sqlalchemy.event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    sqlalchemy.event.listen(engine, 'handle_error', handle_error)
@@ -0,0 +1,117 @@
+"""
+Routing of read-only queries to read replicas.
+
+The router keeps the primary engine and one engine per replica. Read-only
+handlers ask it for an engine and get the healthy replicas in turn, or the
+primary when none is healthy.
+
+A background thread checks the replicas every REPLICA_CHECK_SECONDS. It
+writes the current time to the `replication_heartbeat` row on the primary,
+then reads the row back from each replica. The age of the copy a replica
+holds is its lag. A replica is used while its lag is at most
+REPLICA_MAX_LAG_SECONDS. A replica that cannot be reached, or whose
+connection drops during a request, is skipped until a later check finds it
+healthy again. The check works the same way on local SQLite files, where a
+second file stands in for a replica. Nothing copies the heartbeat to it, so
+`python -m bench.replica_routing` writes it there to check routing to a
+healthy replica and the fallback from a lagging or missing one.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import sqlalchemy
+
+logger = logging.getLogger()
+
+HEARTBEAT_WRITE = sqlalchemy.text('UPDATE replication_heartbeat SET beat_at = :beat_at WHERE id = 1')
+HEARTBEAT_READ = sqlalchemy.text('SELECT beat_at FROM replication_heartbeat WHERE id = 1')
+
+
+class ReplicaRouter:
+    def __init__(self, primary: sqlalchemy.engine.base.Engine, replicas: list,
+                 max_lag: float = 10.0, check_interval: float = 2.0, clock=time.time):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.clock = clock
+        # Replicas that passed the last check. Replaced, never changed in place,
+        # so readers need no lock.
+        self.healthy = []
+        # Lag in seconds per replica from the last check, None if unreachable
+        self.lag = [None] * len(replicas)
+        self.state = ['unchecked'] * len(replicas)
+        self.turn = itertools.count()
+        self.lock = threading.Lock()
+        self.thread = None
+        for replica in replicas:
+            sqlalchemy.event.listen(replica, 'handle_error', self.on_replica_error)
+
+    def reader(self) -> sqlalchemy.engine.base.Engine:
+        """Returns the engine for a read-only query."""
+        if self.thread is None:
+            self.start()
+        healthy = self.healthy
+        if not healthy:
+            return self.primary
+        return healthy[next(self.turn) % len(healthy)]
+
+    # The thread starts with the first read, so each forked worker runs its own
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='replica-check', daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception(e)
+            time.sleep(self.check_interval)
+
+    def check(self) -> None:
+        try:
+            with self.primary.connect() as conn:
+                conn.execute(HEARTBEAT_WRITE, {'beat_at': self.clock()})
+                conn.commit()
+        except Exception as e:
+            logger.warning('Unable to write the replication heartbeat: %s', e)
+
+        healthy = []
+        for index, replica in enumerate(self.replicas):
+            error = None
+            try:
+                with replica.connect() as conn:
+                    beat_at = conn.execute(HEARTBEAT_READ).scalar()
+                lag = self.clock() - beat_at if beat_at is not None else None
+            except Exception as e:
+                error, lag = e, None
+            self.lag[index] = lag
+            if lag is None:
+                state = 'unreachable'
+            elif lag > self.max_lag:
+                state = 'lagging'
+            else:
+                state = 'healthy'
+                healthy.append(replica)
+            # Only changes are logged, not every check
+            if state != self.state[index]:
+                self.state[index] = state
+                if state == 'unreachable':
+                    logger.warning('Read replica %s is unreachable: %s', replica.url, error or 'no heartbeat row')
+                elif state == 'lagging':
+                    logger.warning('Read replica %s is %.1f s behind; reading from the primary', replica.url, lag)
+                else:
+                    logger.info('Read replica %s is in rotation', replica.url)
+        self.healthy = healthy
+
+    # A dropped or refused connection takes the replica out of rotation right
+    # away rather than at the next check
+    def on_replica_error(self, exception_context) -> None:
+        if exception_context.is_disconnect or exception_context.connection is None:
+            engine = exception_context.engine
+            self.healthy = [replica for replica in self.healthy if replica is not engine]
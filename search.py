@@ -0,0 +1,113 @@
+"""
+In-process full-text search for runs without MySQL.
+
+On MySQL the search endpoints use the FULLTEXT indexes on businesses.name
+and reviews.review_text. SQLite has no equivalent, so local runs search an
+inverted index held in memory and ranked with BM25. An index is built from
+the table the first time it is searched. After that the write handlers
+keep it current by calling `update` and `remove` once they have committed.
+
+Each process has its own index, and it sees only the writes that process
+handles, so it is meant for a single local process. Deployments use MySQL.
+"""
+import collections
+import math
+import re
+import threading
+
+import sqlalchemy
+
+TOKEN = re.compile(r'\w+')
+
+# A short stop list, so that words like "the" do not match most documents
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have i in is it its of on or so that the this to was were with'.split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+class InvertedIndex:
+    """BM25 ranked index over one text column of one table."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, table: str, id_column: str, text_column: str):
+        self.load_stmt = sqlalchemy.text(f'SELECT {id_column}, {text_column} FROM {table}')
+        self.postings = collections.defaultdict(dict)
+        self.lengths = {}
+        # The distinct tokens of each document, to find its postings on removal
+        self.terms = {}
+        self.total_length = 0
+        self.built = False
+        self.lock = threading.Lock()
+
+    def build(self, engine: sqlalchemy.engine.base.Engine) -> None:
+        with self.lock:
+            if self.built:
+                return
+            with engine.connect() as conn:
+                for doc_id, text in conn.execute(self.load_stmt):
+                    self._add(doc_id, text)
+            self.built = True
+
+    def update(self, doc_id: int, text: str) -> None:
+        with self.lock:
+            if self.built:
+                self._remove(doc_id)
+                self._add(doc_id, text)
+
+    def remove(self, *doc_ids: int) -> None:
+        with self.lock:
+            if self.built:
+                for doc_id in doc_ids:
+                    self._remove(doc_id)
+
+    def _add(self, doc_id: int, text: str) -> None:
+        tokens = tokenize(text)
+        counts = collections.Counter(tokens)
+        for token, count in counts.items():
+            self.postings[token][doc_id] = count
+        self.terms[doc_id] = tuple(counts)
+        self.lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def _remove(self, doc_id: int) -> None:
+        length = self.lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for token in self.terms.pop(doc_id):
+            postings = self.postings[token]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[token]
+
+    def search(self, query: str, limit: int, after: tuple = None) -> list:
+        """
+        Returns up to `limit` (doc_id, score) pairs, best first and by id
+        among equal scores, following the (score, doc_id) pair `after`.
+        """
+        with self.lock:
+            count = len(self.lengths)
+            if not count:
+                return []
+            average_length = self.total_length / count or 1
+            scores = collections.defaultdict(float)
+            for token in set(tokenize(query)):
+                postings = self.postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.K1 * (1 - self.B + self.B * self.lengths[doc_id] / average_length)
+                    scores[doc_id] += idf * frequency * (self.K1 + 1) / (frequency + norm)
+
+        ranked = sorted(((-score, doc_id) for doc_id, score in scores.items()))
+        if after is not None:
+            after_key = (-after[0], after[1])
+            ranked = [key for key in ranked if key > after_key]
+        return [(doc_id, -negative_score) for negative_score, doc_id in ranked[:limit]]
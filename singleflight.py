@@ -0,0 +1,104 @@
+"""
+Coalescing of concurrent identical reads.
+
+When a request for a coalesced endpoint arrives while an identical request
+is already being served by the same worker, it waits for that request and
+answers with a copy of its response. The later request does not run the
+view, take an admission slot or touch the database. Requests are identical
+when they share the endpoint, the scheme and host, the path and query
+parameters, and the Accept and If-None-Match headers. The scheme and host
+are part of the key because bodies hold absolute `self` and `next` URLs.
+
+The first request, the leader, publishes its status, headers and body once
+its view returns and before compression, so every follower compresses for
+its own Accept-Encoding. A streamed response cannot be copied. A leader
+that ends without publishing, such as one whose response is streamed, sends
+its followers on to be served on their own.
+
+A follower that arrives just after its own write may join a read that
+started before the write. Requests for which `bypass()` is true are
+therefore never coalesced. main passes the check for clients that asked to
+read their own writes.
+"""
+import threading
+
+from flask import current_app, g, request
+
+import metrics
+
+coalesced_total = metrics.registry.add(metrics.Counter(
+    'http_requests_coalesced_total', 'Requests answered with the response of an identical request in flight, by route.',
+    ('route',)))
+
+
+class Flight:
+    __slots__ = ('done', 'response')
+
+    def __init__(self):
+        self.done = threading.Event()
+        # (status, headers, body) once published, None if followers must run on their own
+        self.response = None
+
+
+class SingleFlight:
+    """Flask hooks that coalesce identical GET requests to `endpoints`."""
+
+    def __init__(self, endpoints, bypass=None, wait_seconds: float = 30.0):
+        self.endpoints = set(endpoints)
+        self.bypass = bypass
+        self.wait_seconds = wait_seconds
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def request_key(self):
+        if request.method != 'GET' or request.endpoint not in self.endpoints:
+            return None
+        if self.bypass is not None and self.bypass():
+            return None
+        return (request.endpoint, request.host_url, request.path, tuple(sorted(request.args.items(multi=True))),
+                request.headers.get('Accept'), request.headers.get('If-None-Match'))
+
+    def before_request(self):
+        key = self.request_key()
+        if key is None:
+            return None
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                g.singleflight = (key, flight)
+                return None
+        if not flight.done.wait(self.wait_seconds) or flight.response is None:
+            return None
+        coalesced_total.inc(request.url_rule.rule)
+        status, headers, body = flight.response
+        return current_app.response_class(body, status=status, headers=headers)
+
+    def after_request(self, response):
+        leading = g.get('singleflight')
+        if leading is not None:
+            if not response.is_streamed:
+                leading[1].response = (response.status_code, list(response.headers.items()), response.get_data())
+            self.land()
+        return response
+
+    # Releases the followers of a leader that never reached after_request
+    def teardown_request(self, error=None) -> None:
+        self.land()
+
+    def land(self) -> None:
+        leading = g.pop('singleflight', None)
+        if leading is None:
+            return
+        key, flight = leading
+        with self.lock:
+            self.flights.pop(key, None)
+        flight.done.set()
+
+
+def instrument_app(app, flights: SingleFlight) -> None:
+    app.before_request(flights.before_request)
+    app.after_request(flights.after_request)
+    app.teardown_request(flights.teardown_request)
+    metrics.registry.add(metrics.Gauge('coalescing_in_flight', 'Distinct coalesced requests being served.',
+                                       lambda: len(flights.flights)))
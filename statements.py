@@ -0,0 +1,62 @@
+"""
+Registry of the SQL statements the handlers issue.
+
+Building a `sqlalchemy.text` clause parses out its bind parameters, and the
+first execution of each clause object works out its cache key before
+SQLAlchemy can find the compiled form in the engine's compiled cache. A
+clause object that is executed again keeps its cache key. Statements built
+once at import therefore cost one cache lookup per execution, and each is
+compiled once per engine, on first use.
+
+Fixed statements are added to `registry` by name, next to the handlers
+that run them. Statements whose text depends on the request or the
+dialect, such as a field set's SELECT list or the filters of a page, go
+through `statement(sql)`. It keeps the clauses of the STATEMENT_CACHE_SIZE
+texts used most recently.
+
+This saves work in the application only. MySQL still parses each
+statement, because PyMySQL sends statements as text and has no
+server-side prepared statements.
+"""
+import functools
+import os
+
+import sqlalchemy
+
+STATEMENT_CACHE_SIZE = int(os.environ.get('STATEMENT_CACHE_SIZE', 256))
+
+
+def build(sql: str, expanding: tuple = ()) -> sqlalchemy.TextClause:
+    """Builds the clause for `sql`, with the parameters named in `expanding` taking lists for IN."""
+    clause = sqlalchemy.text(sql)
+    if expanding:
+        clause = clause.bindparams(*(sqlalchemy.bindparam(name, expanding=True) for name in expanding))
+    return clause
+
+
+class Registry:
+    """Named statements, each built once."""
+
+    def __init__(self):
+        self.statements = {}
+
+    def add(self, name: str, sql: str, expanding: tuple = ()) -> sqlalchemy.TextClause:
+        if name in self.statements:
+            raise ValueError(f'Statement {name} is already registered')
+        clause = self.statements[name] = build(sql, expanding)
+        return clause
+
+    def __getitem__(self, name: str) -> sqlalchemy.TextClause:
+        return self.statements[name]
+
+    def items(self):
+        return self.statements.items()
+
+
+registry = Registry()
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def statement(sql: str, expanding: tuple = ()) -> sqlalchemy.TextClause:
+    """The clause for a statement built at run time, reused while its text is in the cache."""
+    return build(sql, expanding)
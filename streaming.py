@@ -0,0 +1,63 @@
+from flask import Response, jsonify, request, stream_with_context
+import sqlalchemy
+
+from serializer import encode
+
+# Streaming responses for list endpoints. Rows are read through a server-side
+# cursor in batches and written out as they arrive, so a worker's memory use
+# does not grow with the number of rows and the first bytes go out as soon as
+# the first batch is read.
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+# Returns 'ndjson' when the client accepts newline-delimited JSON, 'json' for
+# a streamed JSON array when it passes ?stream=true, and None for the default
+# buffered response
+def requested_encoding():
+    if request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def stream_query(engine: sqlalchemy.engine.base.Engine, stmt, params: dict, build, not_found: dict,
+                 encoding: str, batch_size: int = 500):
+    """
+    Runs `stmt` and streams `build(row, url_root)` for each row.
+
+    Responds 404 with `not_found` when there are no rows, matching the
+    buffered handlers. The connection stays checked out until the last row
+    is sent or the client goes away.
+    """
+    conn = engine.connect()
+    try:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt, params)
+        first = result.fetchone()
+    except Exception:
+        conn.close()
+        raise
+    if first is None:
+        result.close()
+        conn.close()
+        return jsonify(not_found), 404
+
+    url_root = request.url_root
+    if encoding == 'ndjson':
+        opening, separator, closing = b'', b'\n', b'\n'
+    else:
+        opening, separator, closing = b'[', b',', b']\n'
+
+    def generate():
+        try:
+            yield opening + encode(build(first, url_root))
+            for batch in result.partitions():
+                yield b''.join(separator + encode(build(row, url_root)) for row in batch)
+            yield closing
+        finally:
+            result.close()
+            conn.close()
+
+    mimetype = NDJSON_MIMETYPE if encoding == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype), 200